@@ -0,0 +1,105 @@
+import argparse
+import pymupdf
+import random
+
+from pathlib import Path
+
+# number of pages, layers, bookmarks and slides of the synthetic documents per corpus scale
+SCALES = {
+    'small': {'watermark_pages': 50, 'ocgs': 200, 'outline_pages': 200, 'outline_depth': 8, 'large_pages': 1000,
+              'slides': 20},
+    'large': {'watermark_pages': 500, 'ocgs': 5000, 'outline_pages': 2000, 'outline_depth': 16, 'large_pages': 5000,
+              'slides': 200},
+}
+
+
+def make_watermarked(path: Path, pages: int, ocgs: int):
+    """Pages with body text and watermark stamps, spread over `ocgs` optional content groups, as in CAD exports or
+    documents with per-page stamps."""
+    doc = pymupdf.Document()
+    xrefs = [doc.add_ocg(f'Watermark {i}', on=True) for i in range(ocgs)]
+    for xref in xrefs:
+        doc.xref_set_key(xref, 'Usage', '<</Print<</PrintState/ON>>/View<</ViewState/ON>>>>')
+
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f'Page {number + 1}', fontsize=20)
+        page.insert_text((72, 110), 'Lorem ipsum dolor sit amet, consectetur adipiscing elit.', fontsize=11)
+        for xref in xrefs[number::pages]:
+            page.insert_text((100 + xref % 300, 400 + xref % 200), 'CONFIDENTIAL', fontsize=30, oc=xref)
+    doc.save(str(path))
+    doc.close()
+
+
+def make_outline(path: Path, pages: int, depth: int):
+    """One bookmark per page, nested down to `depth` levels."""
+    doc = pymupdf.Document()
+    for number in range(pages):
+        doc.new_page().insert_text((72, 72), f'Section {number + 1}', fontsize=20)
+    # levels may only increase by one from one entry to the next
+    doc.set_toc([[number % depth + 1, f'Section {number + 1}', number + 1] for number in range(pages)])
+    doc.save(str(path))
+    doc.close()
+
+
+def make_large(path: Path, pages: int):
+    """Many simple text pages."""
+    doc = pymupdf.Document()
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f'Page {number + 1}', fontsize=20)
+        page.insert_text((72, 110), [f'Line {line + 1} of page {number + 1}' for line in range(20)], fontsize=11)
+    doc.save(str(path))
+    doc.close()
+
+
+def make_slide_deck(path: Path, slides: int, seed: int = 1):
+    """Slides whose items are revealed one page at a time, with some duplicated pages."""
+    rng = random.Random(seed)
+    doc = pymupdf.Document()
+    for slide in range(slides):
+        items = rng.randint(1, 5)
+        for revealed in range(1, items + 1):
+            page = doc.new_page()
+            page.draw_rect(pymupdf.Rect(0, 0, page.rect.width, 60), color=(0, 0, .5), fill=(0, 0, .5))
+            page.insert_text((40, 40), f'Slide {slide + 1}', fontsize=24, color=(1, 1, 1))
+            for item in range(revealed):
+                page.insert_text((72, 120 + 30 * item), f'Item {slide + 1}.{item + 1}', fontsize=18)
+            if revealed == items and slide % 3 == 0:
+                page.draw_circle((300, 600), 40, color=(1, 0, 0))
+        if slide % 4 == 0:
+            doc.fullcopy_page(doc.page_count - 1)
+    doc.save(str(path))
+    doc.close()
+
+
+def build_corpus(directory: str | Path, scale: str = 'small') -> dict[str, Path]:
+    """Create the synthetic documents of the given scale in `directory`, existing documents are reused."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    sizes = SCALES[scale]
+
+    builders = {
+        'watermarks': lambda path: make_watermarked(path, sizes['watermark_pages'], sizes['ocgs']),
+        'outline': lambda path: make_outline(path, sizes['outline_pages'], sizes['outline_depth']),
+        'large': lambda path: make_large(path, sizes['large_pages']),
+        'slides': lambda path: make_slide_deck(path, sizes['slides']),
+    }
+
+    corpus = {}
+    for name, build in builders.items():
+        path = directory / f'{name}-{scale}.pdf'
+        if not path.is_file():
+            print(f'creating {path}')
+            build(path)
+        corpus[name] = path
+    return corpus
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create a synthetic corpus of PDF documents for the benchmarks.')
+    parser.add_argument('directory', help='Directory for the documents')
+    parser.add_argument('--scale', choices=list(SCALES), default='small', help='Size of the documents (default: small)')
+    args = parser.parse_args()
+
+    build_corpus(args.directory, args.scale)
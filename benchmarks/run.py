@@ -0,0 +1,246 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from benchmarks.corpus import SCALES, build_corpus
+from server.src.pdf_tools_core import SAVE_PROFILES, Document, process_document
+
+repository_path = Path(__file__).resolve().parent.parent
+
+# benchmark name -> function, which gets the corpus and the number of repetitions and returns the timed samples as
+# (seconds, processed bytes)
+BENCHMARKS: dict[str, Callable[[dict[str, Path], int], list[tuple[float, int]]]] = {}
+
+
+def benchmark(name: str):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def _timed(function: Callable, size: int = 0) -> tuple[float, int]:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start, size
+
+
+@benchmark('open')
+def benchmark_open(corpus, repeat):
+    samples = []
+    for _ in range(repeat):
+        for file in corpus.values():
+            documents = []
+            samples.append(_timed(lambda: documents.append(Document(filename=file)), file.stat().st_size))
+            documents[0].doc.close()
+    return samples
+
+
+@benchmark('remove_watermarks')
+def benchmark_remove_watermarks(corpus, repeat):
+    samples = []
+    for _ in range(repeat):
+        document = Document(filename=corpus['watermarks'])
+        samples.append(_timed(document.remove_watermarks, corpus['watermarks'].stat().st_size))
+        document.doc.close()
+    return samples
+
+
+def _benchmark_save(corpus, repeat, profile):
+    samples = []
+    for _ in range(repeat):
+        for name in ['watermarks', 'large']:
+            document = Document(filename=corpus[name], save_profile=profile)
+            document.remove_watermarks()
+            samples.append(_timed(document.to_bytes, corpus[name].stat().st_size))
+            document.doc.close()
+    return samples
+
+
+for save_profile in SAVE_PROFILES:
+    benchmark(f'save[{save_profile}]')(lambda corpus, repeat, profile=save_profile: _benchmark_save(corpus, repeat, profile))
+
+
+@benchmark('bookmarks')
+def benchmark_bookmarks(corpus, repeat):
+    def round_trip():
+        document.update_bookmarks(document.get_bookmarks())
+
+    samples = []
+    for _ in range(repeat):
+        document = Document(filename=corpus['outline'])
+        samples.append(_timed(round_trip, corpus['outline'].stat().st_size))
+        document.doc.close()
+    return samples
+
+
+@benchmark('process_document')
+def benchmark_process_document(corpus, repeat):
+    samples = []
+    for _ in range(repeat):
+        for file in corpus.values():
+            samples.append(_timed(lambda: process_document(file.name, path=file,
+                                                           actions=['remove_watermarks', 'unlock_permissions']),
+                                  file.stat().st_size))
+    return samples
+
+
+@benchmark('readable_slideshow_img')
+def benchmark_readable_slideshow(corpus, repeat):
+    # readableSlideshow is run from server/src and imports the core module from there
+    sys.path.insert(0, str(repository_path / 'server' / 'src'))
+    from readableSlideshow import readableSlideshowImg
+
+    return [_timed(lambda: readableSlideshowImg(str(corpus['slides'])), corpus['slides'].stat().st_size)
+            for _ in range(repeat)]
+
+
+@benchmark('server_process_files')
+def benchmark_server(corpus, repeat):
+    # the server expects to be run from the server directory with a client directory next to it
+    working_directory = tempfile.mkdtemp()
+    (Path(working_directory) / 'client').mkdir()
+    os.environ['PDF_TOOLS_JOBS_DIR'] = str(Path(working_directory) / 'jobs')
+    os.environ.setdefault('PDF_TOOLS_WORKERS', '2')
+    # measure the processing, not the result cache
+    os.environ['PDF_TOOLS_CACHE_MEMORY_MB'] = '0'
+    os.chdir(working_directory)
+    sys.path.insert(0, str(repository_path / 'server'))
+
+    from fastapi.testclient import TestClient
+    from src.server import app
+
+    samples = []
+    with TestClient(app) as client:
+        for _ in range(repeat):
+            for name in ['watermarks', 'slides']:
+                content = corpus[name].read_bytes()
+
+                def request():
+                    response = client.post('/api/process-files', data={'actions': 'remove_watermarks'},
+                                           files=[('files', (corpus[name].name, content, 'application/pdf'))])
+                    response.raise_for_status()
+
+                samples.append(_timed(request, len(content)))
+    return samples
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is given in kilobytes on Linux, but in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * unit
+
+
+def _run_benchmark(name: str, corpus: dict[str, Path], repeat: int) -> dict:
+    """Run a single benchmark, meant to be called in a fresh process so that the peak RSS belongs to it."""
+    baseline_rss = _peak_rss_bytes()
+    samples = BENCHMARKS[name](corpus, repeat)
+
+    durations = sorted(seconds for seconds, _ in samples)
+    total_seconds = sum(durations)
+    quantiles = statistics.quantiles(durations, n=100, method='inclusive') if len(durations) > 1 else durations * 99
+    return {
+        'samples': len(durations),
+        'operations_per_second': len(durations) / total_seconds,
+        'megabytes_per_second': sum(size for _, size in samples) / 2**20 / total_seconds,
+        'latency_ms': {
+            'mean': statistics.mean(durations) * 1000,
+            'p50': quantiles[49] * 1000,
+            'p90': quantiles[89] * 1000,
+            'p99': quantiles[98] * 1000,
+            'max': durations[-1] * 1000,
+        },
+        'baseline_rss_mb': baseline_rss / 2**20,
+        'peak_rss_mb': _peak_rss_bytes() / 2**20,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repository_path, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict, threshold: float) -> list[str]:
+    """Print the change of the median latency per benchmark and return the benchmarks that got slower than the
+    threshold (relative change)."""
+    regressions = []
+    print(f'{"benchmark":28} {"before":>12} {"after":>12} {"change":>8}')
+    for name, result in current['benchmarks'].items():
+        if name not in previous['benchmarks']:
+            continue
+        before = previous['benchmarks'][name]['latency_ms']['p50']
+        after = result['latency_ms']['p50']
+        change = after / before - 1
+        marker = ''
+        if change > threshold:
+            regressions.append(name)
+            marker = '  slower'
+        print(f'{name:28} {before:10.2f}ms {after:10.2f}ms {change:+8.1%}{marker}')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the core operations and the server on a synthetic corpus.')
+    parser.add_argument('-d', '--corpus', default=str(Path(tempfile.gettempdir()) / 'pdf-tools-corpus'),
+                        help='Directory of the synthetic corpus, created if necessary')
+    parser.add_argument('--scale', choices=list(SCALES), default='small', help='Size of the corpus (default: small)')
+    parser.add_argument('-b', '--benchmarks', nargs='*', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='Benchmarks to run (default: all)')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='Repetitions per benchmark (default: 5)')
+    parser.add_argument('-o', '--output', help='Write the results as JSON to this file')
+    parser.add_argument('-c', '--compare', metavar='FILE', help='Compare the results to those of a previous run')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='Relative slowdown reported as regression by --compare (default: 0.1)')
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.corpus, args.scale)
+
+    import pymupdf
+
+    results = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'pymupdf': pymupdf.VersionBind,
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'benchmarks': {},
+    }
+
+    # a new process per benchmark keeps the peak memory usage and warm caches of one benchmark out of the others
+    context = multiprocessing.get_context('spawn')
+    for name in args.benchmarks:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            try:
+                result = executor.submit(_run_benchmark, name, corpus, args.repeat).result()
+            except ImportError as e:
+                print(f'{name:28} skipped, {e}')
+                continue
+        results['benchmarks'][name] = result
+        print(f'{name:28} {result["latency_ms"]["p50"]:10.2f} ms median, {result["latency_ms"]["p99"]:10.2f} ms p99, '
+              f'{result["operations_per_second"]:8.1f} ops/s, {result["peak_rss_mb"]:7.1f} MiB peak RSS')
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=4)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            previous = json.load(fp)
+        if compare(previous, results, args.threshold):
+            sys.exit(1)
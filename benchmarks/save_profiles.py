@@ -0,0 +1,53 @@
+import argparse
+import json
+import statistics
+import time
+
+from pathlib import Path
+
+from server.src.pdf_tools_core import SAVE_PROFILES, Document
+
+
+def benchmark_profile(file: Path, profile: str, actions: list[str], repeat: int) -> dict:
+    durations = []
+    size = 0
+    for _ in range(repeat):
+        document = Document(filename=file, save_profile=profile)
+        for action in actions:
+            getattr(document, action)()
+
+        start = time.perf_counter()
+        size = len(document.to_bytes())
+        durations.append(time.perf_counter() - start)
+        document.doc.close()
+
+    return {
+        'file': str(file),
+        'profile': profile,
+        'input_bytes': file.stat().st_size,
+        'output_bytes': size,
+        'median_seconds': statistics.median(durations),
+        'min_seconds': min(durations),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the saving time and output size of the save profiles.')
+    parser.add_argument('files', nargs='+', help='PDF files to save')
+    parser.add_argument('-a', '--actions', nargs='*', choices=['remove_watermarks', 'unlock_permissions'],
+                        default=['remove_watermarks'], help='Actions applied before saving')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='Repetitions per file and profile (default: 5)')
+    parser.add_argument('-o', '--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for file in map(Path, args.files):
+        for profile in SAVE_PROFILES:
+            result = benchmark_profile(file, profile, args.actions, args.repeat)
+            results.append(result)
+            print(f'{file.name:40} {profile:12} {result["median_seconds"] * 1000:10.1f} ms '
+                  f'{result["output_bytes"] / result["input_bytes"]:8.1%} of input size')
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=4)
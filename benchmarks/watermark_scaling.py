@@ -0,0 +1,63 @@
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+from pathlib import Path
+
+from benchmarks.corpus import make_watermarked
+from server.src.pdf_tools_core import Document
+
+
+def remove_watermarks_per_ocg(document: Document):
+    """The previous implementation, one key round trip per OCG of the default layer configuration, for reference."""
+    ocgs = set()
+    for key in ['on', 'off']:
+        if key in document.doc.get_layer(-1):
+            ocgs.update(document.doc.get_layer(-1)[key])
+    for ocg in ocgs:
+        _, usage = document.doc.xref_get_key(ocg, 'Usage')
+        document.set_key(ocg, 'Usage', usage.replace('/ON', '/OFF'))
+
+
+VARIANTS = {
+    'per_ocg': remove_watermarks_per_ocg,
+    'batched': lambda document: document.remove_watermarks(),
+    'strip_content': lambda document: document.remove_watermarks(strip_content=True),
+}
+
+
+def benchmark_ocgs(file: Path, variant: str, repeat: int) -> list[float]:
+    durations = []
+    for _ in range(repeat):
+        document = Document(filename=file)
+        start = time.perf_counter()
+        VARIANTS[variant](document)
+        durations.append(time.perf_counter() - start)
+        document.doc.close()
+    return durations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure how the watermark removal scales with the number of OCGs.')
+    parser.add_argument('-g', '--ocgs', nargs='+', type=int, default=[10, 100, 1000, 5000],
+                        help='Numbers of OCGs of the generated documents (default: 10 100 1000 5000)')
+    parser.add_argument('-p', '--pages', type=int, default=100, help='Pages of the generated documents (default: 100)')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='Repetitions per document (default: 5)')
+    parser.add_argument('-o', '--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for ocgs in args.ocgs:
+            file = Path(directory) / f'watermarks-{ocgs}.pdf'
+            make_watermarked(file, args.pages, ocgs)
+            for variant in VARIANTS:
+                median = statistics.median(benchmark_ocgs(file, variant, args.repeat))
+                results.append({'ocgs': ocgs, 'pages': args.pages, 'variant': variant, 'median_seconds': median})
+                print(f'{ocgs:8} OCGs {variant:14} {median * 1000:10.1f} ms {median / ocgs * 1e6:8.1f} µs per OCG')
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=4)
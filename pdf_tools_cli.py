@@ -2,11 +2,19 @@ import argparse
 import itertools
 import json
 import logging
+import os
+import re
+import signal
 import sys
+import time
 
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 
-from server.src.pdf_tools_core import Document, set_log_level
+from server.src.pdf_tools_core import DEFAULT_SAVE_PROFILE, SAVE_PROFILES, Document, Metrics, ResultCache, \
+    dump_bookmarks_jsonl, file_digest, load_bookmarks_jsonl, metrics, set_log_level
 
 log = logging.getLogger()
 log_handler = logging.StreamHandler()
@@ -14,15 +22,39 @@ log.addHandler(log_handler)
 log_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
 
 output_path = None
+save_profile = DEFAULT_SAVE_PROFILE
+cache: ResultCache | None = None
+# format of the bookmark files next to the documents, "json" (nested) or "jsonl" (one bookmark per line)
+bookmark_format = 'json'
 
+# actions whose result only depends on the document content and can therefore be cached
+CACHEABLE_ACTIONS = ['remove_watermarks', 'strip_watermarks', 'unlock_permissions', 'save']
 
-def _get_documents(path, recursive=False) -> list[Document]:
+# names of the saved documents, "<name>_out.pdf", "<name>_out2.pdf", ... (see _write_output)
+OUTPUT_NAME = re.compile(r'(.+)_out\d*')
+
+
+def _is_output(file: Path) -> bool:
+    """Whether a file is most likely a saved document: named like one and either next to its source document or, if
+    an output path is given, in the output path."""
+    match = OUTPUT_NAME.fullmatch(file.stem)
+    if not match:
+        return False
+    if output_path:
+        return file.parent.resolve() == output_path.resolve()
+    return file.with_name(match[1] + file.suffix).is_file()
+
+
+def _iter_files(path, recursive=False) -> Iterator[Path]:
+    """Lazily yield all PDF files of a path, each file only once, even if it is matched by multiple patterns.
+
+    Saved documents in a directory are skipped (see `_is_output`), since they may be outputs of the current run. A
+    path of a file is always yielded.
+    """
     path = Path(path)
     if path.is_file():
         if path.suffix.lower() == '.pdf':
-            with path.open('rb') as fp:
-                file = Document(filename=path, data=fp.read())
-            return [file]
+            yield path
         else:
             logging.info(f'File "{path}" is not a PDF document.')
     elif path.is_dir():
@@ -31,71 +63,440 @@ def _get_documents(path, recursive=False) -> list[Document]:
         else:
             pattern = '*.pdf'
 
-        documents = []
-
         if sys.version_info.minor >= 12:
             # "case_sensitive" only in 3.12
             file_path_generator_object = path.glob(pattern, case_sensitive=False)
         else:
             generators = [path.glob(pattern), path.glob(pattern.upper())]
             file_path_generator_object = itertools.chain(*generators)
-        for file in file_path_generator_object:
-            documents += _get_documents(file)
 
-        return documents
+        # on case-insensitive file systems both patterns match the same files, so identify files by device and inode
+        seen = set()
+        for file in file_path_generator_object:
+            if not file.is_file():
+                continue
+            if _is_output(file):
+                logging.info(f'Skipping "{file}", which is a saved document.')
+                continue
+            stat = file.stat()
+            if (stat.st_dev, stat.st_ino) in seen:
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+            yield file
     else:
-        raise logging.warning(f'"{path}" is neither a file nor a directory.')
+        logging.warning(f'"{path}" is neither a file nor a directory.')
+
+
+def _cache_key(digest: str, previous_actions: list[str]) -> str:
+    return ResultCache.key(digest, [action for action in previous_actions if action.lower() != 'save'],
+                           {'save_profile': save_profile})
+
+
+def _write_output(source: Path, content: bytes, target: Path | None = None) -> Path:
+    if target:
+        # replace the output of a previous run instead of creating another copy
+        logging.debug(f'saving document to "{target}"')
+        temp_filename = target.with_name(f'.{target.name}.{os.getpid()}.tmp')
+        with metrics.stage('write'), open(temp_filename, 'wb') as fp:
+            fp.write(content)
+        os.replace(temp_filename, target)
+        return target
+
+    directory = output_path or source.parent
+
+    # the output filename is reserved by exclusively creating the file,
+    # so that parallel workers never write to the same file
+    i = 1
+    while True:
+        suffix = '_out' if i == 1 else f'_out{i}'
+        output_filename = directory / (source.stem + suffix + source.suffix)
+        try:
+            fd = os.open(output_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            break
+        except FileExistsError:
+            i += 1
+
+    logging.debug(f'saving document to "{output_filename}"')
+    with metrics.stage('write'), os.fdopen(fd, 'wb') as fp:
+        fp.write(content)
+    return output_filename
+
+
+def _save_from_cache(file: Path, digest: str, actions: list[str], targets: list[Path] = ()) -> list[Path] | None:
+    """Write all outputs of the given actions from the cache without opening the document, if they are all cached."""
+    if not all(action.lower() in CACHEABLE_ACTIONS for action in actions):
+        return None
+
+    contents = []
+    for i, action in enumerate(actions):
+        if action.lower() == 'save':
+            content = cache.get(_cache_key(digest, actions[:i]))
+            if content is None:
+                return None
+            contents.append(content)
+
+    logging.debug(f'using cached results for "{file}"')
+    return [_write_output(file, content, targets[i] if i < len(targets) else None) for i, content in enumerate(contents)]
+
+
+def _bookmark_file(doc: Document) -> Path:
+    return doc.file.with_suffix(f'.{bookmark_format}')
+
+
+def _export_bookmarks(doc: Document):
+    bookmark_file = _bookmark_file(doc)
+    logging.debug(f'creating bookmark file "{bookmark_file}"')
+    with bookmark_file.open('w', encoding='utf-8') as fp:
+        if bookmark_format == 'jsonl':
+            dump_bookmarks_jsonl(doc.get_toc(), fp)
+        else:
+            json.dump(doc.get_bookmarks(), fp, indent=4)
 
 
-def _perform_action(doc: Document, action: str):
-    global output_path
+def _import_bookmarks(doc: Document):
+    bookmark_file = _bookmark_file(doc)
+    logging.debug(f'updating bookmarks from "{bookmark_file}"')
+    with bookmark_file.open(encoding='utf-8') as fp:
+        if bookmark_format == 'jsonl':
+            doc.update_toc(load_bookmarks_jsonl(fp))
+        else:
+            doc.update_bookmarks(json.load(fp))
+
+
+def _perform_action(doc: Document, action: str, digest: str | None = None,
+                    previous_actions: list[str] = (), target: Path | None = None) -> Path | None:
+    """Perform a single action on a document. Returns the output filename for the save action."""
 
     if action.lower() in ['remove_watermarks']:
         doc.remove_watermarks()
+    elif action.lower() in ['strip_watermarks']:
+        doc.remove_watermarks(strip_content=True)
     elif action.lower() in ['unlock_permissions']:
         doc.unlock_permissions()
     elif action.lower() in ['edit_bookmarks']:
-        bookmark_file = doc.file.with_suffix('.json')
-
-        if bookmark_file.is_file():
-            logging.debug(f'updating bookmarks from "{bookmark_file}"')
-            with bookmark_file.open() as fp:
-                new_bookmarks: list = json.load(fp)
-            doc.update_bookmarks(new_bookmarks)
+        if _bookmark_file(doc).is_file():
+            _import_bookmarks(doc)
         else:
-            logging.debug(f'creating bookmark file "{bookmark_file}"')
-            bookmarks = doc.get_bookmarks()
-            with bookmark_file.open('w+') as fp:
-                json.dump(bookmarks, fp, indent=4)
+            _export_bookmarks(doc)
+    elif action.lower() in ['export_bookmarks']:
+        _export_bookmarks(doc)
+    elif action.lower() in ['import_bookmarks']:
+        if _bookmark_file(doc).is_file():
+            _import_bookmarks(doc)
+        else:
+            logging.warning(f'No bookmark file "{_bookmark_file(doc)}" found, keeping the bookmarks.')
     elif action.lower() in ['save']:
-        if not output_path:
-            output_path = doc.file.parent
-        output_filename = output_path / (doc.file.stem + '_out' + doc.file.suffix)
-
-        i = 2
-        while output_filename.exists():
-            output_filename = output_path / (doc.file.stem + f'_out{i}' + doc.file.suffix)
-            i += 1
+        key = None
+        if cache and digest and all(a.lower() in CACHEABLE_ACTIONS for a in previous_actions):
+            key = _cache_key(digest, previous_actions)
 
-        logging.debug(f'saving document to "{output_filename}"')
-        with open(output_filename, 'wb') as fp:
-            fp.write(doc.to_bytes())
+        content = cache.get(key) if key else None
+        if content is None:
+            content = doc.to_bytes()
+            if key:
+                cache.put(key, content)
+        return _write_output(doc.file, content, target)
     else:
         logging.warning(f'ignoring unknown action: {action}')
 
 
+def _process_file(file: Path, actions: list[str], digest: str | None = None,
+                  targets: list[Path] = ()) -> tuple[str, list[Path]]:
+    """Open a single document, apply all actions to it and close it again. Returns the status and the outputs.
+
+    The outputs are written to `targets` (one per save action) if given, otherwise to new files.
+    """
+    logging.debug(f'processing document "{file}"')
+
+    if cache:
+        digest = digest or file_digest(file)
+        outputs = _save_from_cache(file, digest, actions, targets)
+        if outputs is not None:
+            return 'cached', outputs
+
+    outputs = []
+    document = Document(filename=file, save_profile=save_profile)
+    try:
+        for i, action in enumerate(actions):
+            target = targets[len(outputs)] if action.lower() == 'save' and len(outputs) < len(targets) else None
+            output = _perform_action(document, action, digest, actions[:i], target)
+            if output:
+                outputs.append(output)
+    finally:
+        document.doc.close()
+    return 'processed', outputs
+
+
+def _output_directory(file: Path) -> str:
+    return str((output_path or file.parent).resolve())
+
+
+def _is_unchanged(file: Path, stat: os.stat_result, entry: dict, actions: list[str]) -> tuple[bool, str | None]:
+    """Compare a file to its manifest entry. Returns whether it is unchanged and its digest, if it had to be computed."""
+    if entry['actions'] != actions or entry.get('save_profile', DEFAULT_SAVE_PROFILE) != save_profile:
+        return False, None
+    if entry.get('output_directory') != _output_directory(file):
+        return False, None
+    if not all(Path(output).is_file() for output in entry['outputs']):
+        return False, None
+    if entry['size'] != stat.st_size:
+        return False, None
+    if entry['mtime_ns'] == stat.st_mtime_ns:
+        return True, entry['sha256']
+
+    # the file was touched, but its content might still be the same
+    digest = file_digest(file)
+    return digest == entry['sha256'], digest
+
+
+def _run_file(file: Path, actions: list[str], entry: dict | None = None, record: bool = False) -> dict:
+    """Process a single document and report the outcome for the summary, errors do not stop the run.
+
+    If a manifest `entry` of a previous run is given, unchanged files are skipped and the outputs of changed files
+    replace the previous ones. With `record` the result contains everything needed for a new manifest entry.
+    """
+    start = time.perf_counter()
+    stat = file.stat()
+    digest = None
+    try:
+        unchanged = False
+        if entry:
+            unchanged, digest = _is_unchanged(file, stat, entry, actions)
+
+        if unchanged:
+            logging.debug(f'skipping unchanged document "{file}"')
+            status, outputs = 'skipped', [Path(output) for output in entry['outputs']]
+        else:
+            if record and not digest:
+                digest = file_digest(file)
+            # outputs of a previous run are only replaced if they are in the current output directory
+            targets = [Path(output) for output in entry['outputs']] \
+                if entry and entry.get('output_directory') == _output_directory(file) else []
+            status, outputs = _process_file(file, actions, digest, targets)
+        error = None
+    except Exception as e:
+        logging.error(f'Failed to process "{file}": {e}')
+        status, outputs, error = 'failed', [], str(e)
+    result = {'file': str(file), 'status': status, 'outputs': [str(output) for output in outputs],
+              'seconds': time.perf_counter() - start, 'error': error,
+              'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    if metrics.enabled:
+        # the metrics of this file, which may have been processed in a worker process
+        result['metrics'] = metrics.snapshot()
+        metrics.reset()
+    return result
+
+
+def _load_manifest(path: Path) -> dict:
+    if not path.is_file():
+        return {'version': 1, 'files': {}}
+    with path.open() as fp:
+        return json.load(fp)
+
+
+def _save_manifest(path: Path, manifest: dict):
+    # write to a temporary file first, so that an interrupted run never leaves a broken manifest
+    temp_path = path.with_name(f'.{path.name}.tmp')
+    with temp_path.open('w') as fp:
+        json.dump(manifest, fp)
+    os.replace(temp_path, path)
+
+
+def _update_manifest(manifest: dict, result: dict, actions: list[str]):
+    if result['status'] == 'failed':
+        return
+    manifest['files'][str(Path(result['file']).resolve())] = {
+        'size': result['size'],
+        'mtime_ns': result['mtime_ns'],
+        'sha256': result['sha256'],
+        'actions': actions,
+        'save_profile': save_profile,
+        'output_directory': _output_directory(Path(result['file'])),
+        'outputs': [str(Path(output).resolve()) for output in result['outputs']],
+    }
+
+
+def _init_worker(output: Path | None, profile: str, cache_directory: str | None, log_level: int,
+                 metrics_enabled: bool = False, bookmarks: str = 'json'):
+    global output_path, save_profile, cache, bookmark_format
+    output_path = output
+    save_profile = profile
+    bookmark_format = bookmarks
+    cache = ResultCache(directory=cache_directory) if cache_directory else None
+    set_log_level(log_level)
+    metrics.enabled = metrics_enabled
+
+
+def _run_files(files: Iterator[tuple[Path, dict | None]], actions: list[str], jobs: int = 1,
+               record: bool = False) -> Iterator[dict]:
+    """Run all files (with their manifest entries) through `_run_file`, either in this process or spread over `jobs`
+    worker processes."""
+    if jobs <= 1:
+        for file, entry in files:
+            yield _run_file(file, actions, entry, record)
+        return
+
+    initargs = (output_path, save_profile, str(cache.directory) if cache else None, log.level, metrics.enabled,
+                bookmark_format)
+    executor = None
+
+    def collect(future, file: Path) -> dict:
+        nonlocal executor
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            # a crashed worker fails all pending files, the remaining files are run by a new executor
+            logging.error(f'Failed to process "{file}": a worker process crashed')
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = None
+            return {'file': str(file), 'status': 'failed', 'outputs': [], 'seconds': 0.0,
+                    'error': f'a worker process crashed: {e}'}
+
+    try:
+        # limit the number of submitted files, so that the directory walk stays lazy
+        pending = {}
+        for file, entry in files:
+            if len(pending) >= 2 * jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield collect(future, pending.pop(future))
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=initargs)
+            pending[executor.submit(_run_file, file, actions, entry, record)] = file
+
+        for future in wait(pending).done:
+            yield collect(future, pending[future])
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _print_summary(results: list[dict], seconds: float):
+    counts = {status: sum(result['status'] == status for result in results)
+              for status in ['processed', 'cached', 'skipped', 'failed']}
+    durations = sorted(result['seconds'] for result in results)
+
+    print(f'{len(results)} documents in {seconds:.2f}s: '
+          f'{counts["processed"]} processed, {counts["cached"]} from cache, '
+          f'{counts["skipped"]} unchanged, {counts["failed"]} failed')
+    print(f'time per document: mean {sum(durations) / len(durations):.3f}s, '
+          f'median {durations[len(durations) // 2]:.3f}s, max {durations[-1]:.3f}s')
+    for result in results:
+        if result['status'] == 'failed':
+            print(f'failed: {result["file"]}: {result["error"]}')
+
+
+def _save_profile_report(path: Path, results: list[dict], seconds: float, stages: Metrics, jobs: int):
+    """Write the merged per-stage timings and counters of all documents as a JSON report."""
+    report = {
+        'seconds': seconds,
+        'jobs': jobs,
+        'save_profile': save_profile,
+        'documents': {status: sum(result['status'] == status for result in results)
+                      for status in ['processed', 'cached', 'skipped', 'failed']},
+        **stages.to_dict(),
+        'files': [{'file': result['file'], 'status': result['status'], 'seconds': result['seconds']}
+                  for result in results],
+    }
+    with path.open('w') as fp:
+        json.dump(report, fp, indent=4)
+
+
+def _run_job(job: dict, default_actions: list[str]) -> dict:
+    """Run a job of the worker mode. A job is a JSON object with the "file" (or directory) to process and optionally an
+    "id", "actions", "recursive", "output", "save_profile", "bookmark_format" and "jobs"."""
+    global output_path, save_profile, bookmark_format
+    settings = output_path, save_profile, bookmark_format
+    try:
+        if job.get('output'):
+            output_path = Path(job['output'])
+            if not output_path.is_dir():
+                raise ValueError(f'output path "{output_path}" is not a directory')
+        save_profile = job.get('save_profile', save_profile)
+        if save_profile not in SAVE_PROFILES:
+            raise ValueError(f'unknown save profile "{save_profile}"')
+        bookmark_format = job.get('bookmark_format', bookmark_format)
+
+        files = ((file, None) for file in _iter_files(job['file'], job.get('recursive', False)))
+        results = list(_run_files(files, job.get('actions', default_actions), job.get('jobs', 1)))
+    finally:
+        output_path, save_profile, bookmark_format = settings
+
+    for result in results:
+        result.pop('metrics', None)
+    return {'id': job.get('id'), 'results': results}
+
+
+def _serve(lines: Iterable[str], respond: Callable[[str], None], default_actions: list[str]):
+    """Run each job given as a line of JSON and respond with one line of JSON per job."""
+    for line in lines:
+        if not line.strip():
+            continue
+        job = None
+        try:
+            job = json.loads(line)
+            response = _run_job(job, default_actions)
+        except Exception as e:
+            logging.error(f'Failed to run job: {e}')
+            response = {'id': job.get('id') if isinstance(job, dict) else None, 'error': str(e)}
+        respond(json.dumps(response) + '\n')
+
+
+def _serve_socket(path: str, default_actions: list[str]):
+    """Run the jobs sent to a Unix socket, one connection after the other."""
+    import socketserver
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            _serve((line.decode() for line in self.rfile), lambda response: self.wfile.write(response.encode()),
+                   default_actions)
+
+    # remove the socket file also when the worker is terminated
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    Path(path).unlink(missing_ok=True)
+    with socketserver.UnixStreamServer(path, JobHandler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            Path(path).unlink(missing_ok=True)
+
+
+def _redirect_stdout():
+    """Return a file for the responses of the worker mode, a duplicate of stdout, and redirect everything else that is
+    written to stdout (e.g. warnings printed by PyMuPDF) to stderr, so it can't be mistaken for a response."""
+    sys.stdout.flush()
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    return responses
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="PDF tools provides helper tools for PDF documents, which can be selected via the actions argument. These actions are then applied to all selected files.")
-    parser.add_argument('file', help='Path or filename to process')
+    parser.add_argument('file', nargs='?', help='Path or filename to process')
     parser.add_argument('-r', '--recursive', action='store_true', help='Recursively process directory')
     parser.add_argument('-a', '--actions', nargs='*',
-                        choices=['remove_watermarks', 'unlock_permissions', 'edit_bookmarks', 'save'],
+                        choices=['remove_watermarks', 'strip_watermarks', 'unlock_permissions', 'edit_bookmarks',
+                                 'export_bookmarks', 'import_bookmarks', 'save'],
                         default=['remove_watermarks', 'unlock_permissions', 'save'],
                         help='List of actions to perform')
     parser.add_argument('-o', '--output', help='Output path for saved files', required=False)
+    parser.add_argument('-s', '--save-profile', choices=list(SAVE_PROFILES), default=DEFAULT_SAVE_PROFILE,
+                        help=f'Trade-off between saving time and file size (default: {DEFAULT_SAVE_PROFILE})')
+    parser.add_argument('-b', '--bookmark-format', choices=['json', 'jsonl'], default='json',
+                        help='Format of the bookmark files: nested JSON or one bookmark per line (default: json)')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1, help='Number of documents processed in parallel (default: 1)')
+    parser.add_argument('-c', '--cache', metavar='DIR', help='Cache processed documents in this directory and reuse them for unchanged input files', required=False)
+    parser.add_argument('-m', '--manifest', metavar='FILE', help='Record processed documents in this manifest and skip unchanged documents in later runs', required=False)
+    parser.add_argument('-p', '--profile', metavar='FILE', help='Write per-stage timings and counters as a JSON report to this file', required=False)
+    parser.add_argument('-w', '--worker', action='store_true', help='Keep running and process jobs, which are read as JSON lines from stdin or --socket')
+    parser.add_argument('--socket', metavar='PATH', help='Read the jobs of the worker mode from connections to this Unix socket', required=False)
     parser.add_argument('-v', '--verbose', action='store_true')
 
     args = parser.parse_args()
+    if not args.file and not args.worker:
+        parser.error('the following arguments are required: file')
 
     if args.verbose:
         log.setLevel(logging.DEBUG)
@@ -107,15 +508,29 @@ if __name__ == '__main__':
             logging.warning('If specified, output path must be a valid directory. Exiting now.')
             exit(1)
 
-    documents = _get_documents(args.file, args.recursive)
-    if documents:
-        logging.debug('found documents:')
-        for document in documents:
-            logging.debug(document.file)
-        logging.debug('')
-    else:
-        logging.warning('No documents selected. Exiting now.')
-        exit(1)
+    save_profile = args.save_profile
+    bookmark_format = args.bookmark_format
+
+    # instrumentation is disabled unless a report was requested
+    profile_metrics = Metrics(enabled=True)
+    metrics.enabled = bool(args.profile)
+
+    if args.cache:
+        cache = ResultCache(directory=args.cache)
+
+    if args.worker:
+        # the given options are the defaults of all jobs
+        if args.socket:
+            _serve_socket(args.socket, args.actions)
+        else:
+            responses = _redirect_stdout()
+
+            def respond(response: str):
+                responses.write(response)
+                responses.flush()
+
+            _serve(sys.stdin, respond, args.actions)
+        exit(0)
 
     if args.actions:
         logging.debug('selected actions:')
@@ -126,8 +541,42 @@ if __name__ == '__main__':
         logging.warning('No actions specified. Exiting now.')
         exit(1)
 
-    for document in documents:
-        logging.debug(f'processing document "{document.file}"')
-        for action in args.actions:
-            _perform_action(document, action)
-        document.doc.close()
+    # walk -> open -> apply actions -> save -> close, with at most one document per job at a time
+    run_started = time.time()
+    files = _iter_files(args.file, args.recursive)
+
+    manifest = None
+    if args.manifest:
+        manifest_path = Path(args.manifest)
+        manifest = _load_manifest(manifest_path)
+        # outputs of previous runs are not inputs
+        previous_outputs = {output for entry in manifest['files'].values() for output in entry['outputs']}
+        files = (file for file in files if str(file.resolve()) not in previous_outputs)
+
+    files = ((file, manifest['files'].get(str(file.resolve())) if manifest else None) for file in files)
+
+    results = []
+    try:
+        for result in _run_files(files, args.actions, args.jobs, record=manifest is not None):
+            profile_metrics.merge(result.pop('metrics', {'stages': {}, 'counters': {}}))
+            results.append(result)
+            if manifest is not None:
+                _update_manifest(manifest, result, args.actions)
+                if len(results) % 100 == 0:
+                    _save_manifest(manifest_path, manifest)
+    finally:
+        # also keep the finished documents of an interrupted run
+        if manifest is not None:
+            _save_manifest(manifest_path, manifest)
+
+    if not results:
+        logging.warning('No documents selected. Exiting now.')
+        exit(1)
+
+    _print_summary(results, time.time() - run_started)
+
+    if args.profile:
+        _save_profile_report(Path(args.profile), results, time.time() - run_started, profile_metrics, args.jobs)
+
+    if cache:
+        logging.debug(f'cache statistics: {cache.stats}')
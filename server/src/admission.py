@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+from http import HTTPStatus
+from fastapi import HTTPException, status
+from starlette.responses import JSONResponse
+
+from src.pdf_tools_core import metrics
+
+# starlette renamed the constant for status 413, which is therefore taken from the standard library
+HTTP_413_CONTENT_TOO_LARGE = HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+
+class Admission:
+    """Limits for uploads: the size of a request, a budget for the bytes of all requests in flight and the number of
+    concurrent requests per client.
+
+    Requests which do not fit into the budget wait up to `timeout` seconds for other requests to finish.
+    """
+
+    def __init__(self, max_request_bytes: int, max_in_flight_bytes: int, max_client_requests: int, timeout: float):
+        self.max_request_bytes = max_request_bytes
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.max_client_requests = max_client_requests
+        self.timeout = timeout
+
+        self.in_flight_bytes = 0
+        self.waiting_requests = 0
+        self.client_requests: dict[str, int] = {}
+        self.condition = asyncio.Condition()
+        self.stats = {'admitted': 0, 'rejected_too_large': 0, 'rejected_busy': 0, 'rejected_client_limit': 0}
+
+    async def acquire(self, size: int):
+        """Reserve `size` bytes of the budget, waiting for other requests to release theirs if necessary."""
+        start = time.perf_counter()
+        async with self.condition:
+            self.waiting_requests += 1
+            try:
+                # a request larger than the budget is admitted once no other request is in flight
+                await asyncio.wait_for(self.condition.wait_for(
+                    lambda: not self.in_flight_bytes or self.in_flight_bytes + size <= self.max_in_flight_bytes),
+                    self.timeout)
+            except TimeoutError:
+                self.stats['rejected_busy'] += 1
+                raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail='Server is busy, please try again later.',
+                                    headers={'Retry-After': '5'})
+            finally:
+                self.waiting_requests -= 1
+            self.in_flight_bytes += size
+        metrics.observe('admission_wait', time.perf_counter() - start)
+
+    async def release(self, size: int):
+        async with self.condition:
+            self.in_flight_bytes -= size
+            self.condition.notify_all()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware, which applies the limits of `admission` to the POST requests of the given paths.
+
+    Requests are checked by their Content-Length before their body is read. Bodies without a length, or longer than
+    announced, are counted while they are received.
+
+    Clients are identified by their address. Requests from one of the `trusted_proxies` are identified by the last
+    address of their X-Forwarded-For header which is not a trusted proxy itself.
+    """
+
+    def __init__(self, app, admission: Admission, paths: list[str], trusted_proxies: list[str] = ()):
+        self.app = app
+        self.admission = admission
+        self.paths = set(paths)
+        self.trusted_proxies = set(trusted_proxies)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        admission = self.admission
+        content_length = dict(scope['headers']).get(b'content-length')
+        size = int(content_length) if content_length and content_length.isdigit() else admission.max_request_bytes
+        client = self._client(scope)
+
+        if size > admission.max_request_bytes:
+            admission.stats['rejected_too_large'] += 1
+            await self._reject(scope, receive, send, HTTP_413_CONTENT_TOO_LARGE,
+                               f'Request exceeds the limit of {admission.max_request_bytes} bytes.')
+            return
+        if admission.max_client_requests and admission.client_requests.get(client, 0) >= admission.max_client_requests:
+            admission.stats['rejected_client_limit'] += 1
+            await self._reject(scope, receive, send, status.HTTP_429_TOO_MANY_REQUESTS,
+                               'Too many concurrent requests, please try again later.', {'Retry-After': '5'})
+            return
+
+        admission.client_requests[client] = admission.client_requests.get(client, 0) + 1
+        try:
+            try:
+                await admission.acquire(size)
+            except HTTPException as e:
+                await self._reject(scope, receive, send, e.status_code, e.detail, e.headers)
+                return
+
+            admission.stats['admitted'] += 1
+            try:
+                await self.app(scope, self._limit_body(receive, size), send)
+            finally:
+                await admission.release(size)
+        finally:
+            admission.client_requests[client] -= 1
+            if not admission.client_requests[client]:
+                del admission.client_requests[client]
+
+    def _client(self, scope) -> str:
+        client = scope['client'][0] if scope.get('client') else 'unknown'
+        if client not in self.trusted_proxies:
+            return client
+        # each proxy appends the address it received the request from, so the header is read from the end
+        forwarded = b','.join(value for name, value in scope['headers'] if name == b'x-forwarded-for')
+        for address in reversed(forwarded.decode('latin-1').split(',')):
+            address = address.strip()
+            if address and address not in self.trusted_proxies:
+                return address
+        return client
+
+    def _limit_body(self, receive, size: int):
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > size:
+                    # raised while the app parses the body, which turns it into the response
+                    self.admission.stats['rejected_too_large'] += 1
+                    raise HTTPException(HTTP_413_CONTENT_TOO_LARGE,
+                                        detail=f'Request exceeds the limit of {size} bytes.')
+            return message
+
+        return limited_receive
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, detail: str, headers: dict | None = None):
+        response = JSONResponse({'detail': detail}, status_code, headers=headers)
+        await response(scope, receive, send)
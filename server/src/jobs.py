@@ -0,0 +1,183 @@
+import asyncio
+import itertools
+import logging
+import os
+import pathlib
+import shutil
+import time
+import uuid
+
+from typing import Awaitable, Callable
+
+from src.pdf_tools_core import metrics
+
+# priorities of the worker queue, files of synchronous requests are processed before files of batch jobs
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+
+class JobFile:
+    def __init__(self, index: int, name: str, input_path: pathlib.Path, digest: str):
+        self.index = index
+        self.name = name
+        self.input_path = input_path
+        self.digest = digest
+        self.output_path: pathlib.Path | None = None
+        self.status = 'queued'
+        self.error: str | None = None
+        self.finished = asyncio.Event()
+        self.queued = time.perf_counter()
+
+    def to_dict(self):
+        return {'index': self.index, 'name': self.name, 'status': self.status, 'error': self.error}
+
+
+class Job:
+    def __init__(self, directory: pathlib.Path, actions: list[str], save_profile: str,
+                 on_file_finished: Callable[[JobFile], None] | None = None):
+        self.id = uuid.uuid4().hex
+        self.directory = directory / self.id
+        self.actions = actions
+        self.save_profile = save_profile
+        self.files: list[JobFile] = []
+        self.on_file_finished = on_file_finished
+        self.cancelled = False
+        self.created = time.time()
+        self.finished: float | None = None
+
+    @property
+    def status(self):
+        if self.cancelled:
+            return 'cancelled'
+        if self.finished is not None:
+            return 'finished'
+        if any(file.status != 'queued' for file in self.files):
+            return 'processing'
+        return 'queued'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'created': self.created,
+            'finished': self.finished,
+            'progress': {status: sum(file.status == status for file in self.files)
+                         for status in ['queued', 'processing', 'done', 'failed', 'cancelled']},
+            'files': [file.to_dict() for file in self.files],
+        }
+
+
+class JobManager:
+    """Local job queue, which processes the files of all jobs with a fixed number of workers.
+
+    The results are kept in a directory per job until `ttl` seconds after the job finished. The job directories are
+    created in a subdirectory of `directory`, which belongs to this process and is removed when the manager stops.
+    """
+
+    def __init__(self, directory: pathlib.Path,
+                 process: Callable[[str, pathlib.Path, str, list[str], str], Awaitable[bytes]],
+                 workers: int, ttl: float):
+        self.directory = directory / f'pdf-tools-jobs-{os.getpid()}'
+        self.process = process
+        self.workers = workers
+        self.ttl = ttl
+        self.jobs: dict[str, Job] = {}
+        self.queue: asyncio.PriorityQueue | None = None
+        self.queued_files = 0
+        self.order = itertools.count()  # keeps the queue first in, first out within a priority
+        self.tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        # jobs are not persisted, so results of a previous run of this process can't be accessed anymore
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True)
+
+        self.queue = asyncio.PriorityQueue()
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self._clean_up()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def submit(self, files: list[tuple[str, pathlib.Path, str]], actions: list[str], save_profile: str,
+               priority: int = PRIORITY_BATCH, on_file_finished: Callable[[JobFile], None] | None = None) -> Job:
+        """Create a job for the spooled files given as (name, path, digest) and queue all of its files."""
+        job = Job(self.directory, actions, save_profile, on_file_finished)
+        job.directory.mkdir()
+        self.jobs[job.id] = job
+
+        for index, (name, path, digest) in enumerate(files):
+            file = JobFile(index, name, path, digest)
+            job.files.append(file)
+            self.queue.put_nowait((priority, next(self.order), job, file))
+            self.queued_files += 1
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        """Cancel a job and delete its results. Files that are being processed finish, but their results are dropped."""
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            return
+        job.cancelled = True
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+    async def _work(self):
+        while True:
+            _, _, job, file = await self.queue.get()
+            self.queued_files -= 1
+            try:
+                if job.cancelled:
+                    file.status = 'cancelled'
+                    file.input_path.unlink(missing_ok=True)
+                    continue
+
+                file.status = 'processing'
+                metrics.observe('queue_wait', time.perf_counter() - file.queued)
+                try:
+                    content = await self.process(file.name, file.input_path, file.digest, job.actions,
+                                                 job.save_profile)
+                    if job.cancelled:
+                        file.status = 'cancelled'
+                        continue
+
+                    # the index keeps files with the same name apart
+                    output_path = job.directory / str(file.index) / pathlib.Path(file.name).name
+                    await asyncio.to_thread(self._write, output_path, content)
+                    if job.cancelled:
+                        # cancelled while writing
+                        shutil.rmtree(job.directory, ignore_errors=True)
+                        file.status = 'cancelled'
+                        continue
+                    file.output_path = output_path
+                    file.status = 'done'
+                except Exception as e:
+                    logging.error(f'Failed to process "{file.name}" of job {job.id}: {e}')
+                    file.status = 'failed'
+                    file.error = str(e)
+            finally:
+                file.finished.set()
+                if all(file.finished.is_set() for file in job.files):
+                    job.finished = time.time()
+                if job.on_file_finished:
+                    job.on_file_finished(file)
+                self.queue.task_done()
+
+    @staticmethod
+    def _write(path: pathlib.Path, content: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+    async def _clean_up(self):
+        while True:
+            await asyncio.sleep(min(self.ttl, 60))
+            now = time.time()
+            for job in list(self.jobs.values()):
+                if job.finished is not None and now - job.finished > self.ttl:
+                    logging.debug(f'removing expired job {job.id}')
+                    self.cancel(job.id)
@@ -1,86 +1,421 @@
-import fitz
+import bisect
+import hashlib
 import io
+import json
 import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
 
+from collections import OrderedDict
 from pathlib import Path
 
+# pymupdf is only imported once a document is opened, so that importing this module stays cheap
+
 log = logging.getLogger()
-log_handler = logging.StreamHandler()
-log.addHandler(log_handler)
-log_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
 
 
 def set_log_level(level: int | str):
+    # the handler is only added once logging is configured, and only if the application did not add one itself
+    if not log.handlers:
+        log_handler = logging.StreamHandler()
+        log_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+        log.addHandler(log_handler)
     log.setLevel(level)
 
 
-ALL_PERMISSIONS_GRANTED = fitz.PDF_PERM_PRINT \
-    + fitz.PDF_PERM_MODIFY \
-    + fitz.PDF_PERM_COPY \
-    + fitz.PDF_PERM_ANNOTATE \
-    + fitz.PDF_PERM_FORM \
-    + fitz.PDF_PERM_ACCESSIBILITY \
-    + fitz.PDF_PERM_ASSEMBLE \
-    + fitz.PDF_PERM_PRINT_HQ
+# the values of pymupdf.PDF_PERM_PRINT, _MODIFY, _COPY, _ANNOTATE, _FORM, _ACCESSIBILITY, _ASSEMBLE and _PRINT_HQ
+ALL_PERMISSIONS_GRANTED = 4 \
+    + 8 \
+    + 16 \
+    + 32 \
+    + 256 \
+    + 512 \
+    + 1024 \
+    + 2048
+
+# options for pymupdf's `Document.tobytes()`, from fastest to smallest output
+SAVE_PROFILES = {
+    'fast': {'garbage': 0, 'clean': False, 'deflate': False},
+    'balanced': {'garbage': 1, 'clean': False, 'deflate': True},
+    'compact': {'garbage': 3, 'clean': True, 'deflate': True},
+    # only append the changed objects to the original file, falls back to "balanced" if that is not possible
+    'incremental': {'incremental': True},
+}
+DEFAULT_SAVE_PROFILE = 'compact'
+INCREMENTAL_FALLBACK_PROFILE = 'balanced'
+
+# part of every cache key, increase it whenever the output of an action changes, so that cached results are not reused
+# 2: remove_watermarks turns off all OCGs of the catalog, not only those of the default layer configuration
+# 3: strip_watermarks also strips pages with inherited resources and form XObjects of the OCGs
+CACHE_VERSION = 3
+
+# states of an OCG's usage dictionary, which make viewers show or print its content
+_USAGE_STATE_ON = re.compile(r'(/(?:View|Print|Export)State\s*)/ON(?=[\s/<>\[\]()]|$)')
+_REFERENCE = re.compile(r'(\d+)\s+\d+\s+R')
+_INDIRECT_USAGE = re.compile(r'/Usage\s*(\d+)\s+\d+\s+R')
+_PROPERTY_REFERENCE = re.compile(r'/([^\s/<>\[\]()%{}]+)\s*(\d+)\s+\d+\s+R')
+
+# content stream syntax for removing optional content
+_OC_MARKED_CONTENT = re.compile(rb'/OC\s*/([^\s/<>\[\]()%{}]+)\s*BDC')
+_CONTENT_TOKEN = re.compile(rb'%[^\r\n]*|<<|>>|<[^<>]*>|\(|/[^\s/<>\[\]()%{}]*|[^\s/<>\[\]()%{}]+|[\[\]{}]')
+_STRING_DELIMITER = re.compile(rb'[\\()]')
+_INLINE_IMAGE_END = re.compile(rb'\sEI(?=\s|$)')
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *_):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *_):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+class Metrics:
+    """Per-process counters and stage timers. While disabled, recording is reduced to a flag check.
+
+    A snapshot is a plain dict, so the metrics of worker processes can be returned and merged by the caller.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.stages: dict[str, list] = {}  # stage name -> [count, seconds]
+        self.counters: dict[str, int] = {}
+
+    def stage(self, name: str):
+        """Context manager, which adds the time spent within it to the given stage."""
+        return _StageTimer(self, name) if self.enabled else _NO_TIMER
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        stage = self.stages.setdefault(name, [0, 0.0])
+        stage[0] += 1
+        stage[1] += seconds
+
+    def add(self, name: str, value: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        return {'stages': {name: list(stage) for name, stage in self.stages.items()}, 'counters': dict(self.counters)}
 
+    def reset(self):
+        self.stages.clear()
+        self.counters.clear()
 
-def _extract_bookmarks(outline: fitz.Outline):
-    """Helper function to extract bookmarks from an pymupdf Outline object."""
+    def merge(self, snapshot: dict):
+        for name, (count, seconds) in snapshot['stages'].items():
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += count
+            stage[1] += seconds
+        for name, value in snapshot['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        return {
+            'stages': {name: {'count': count, 'seconds': seconds} for name, (count, seconds) in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+
+    def to_prometheus(self, prefix: str = 'pdf_tools') -> str:
+        """Format the metrics in the Prometheus text exposition format."""
+        lines = [
+            f'# HELP {prefix}_stage_seconds_total Time spent in each processing stage.',
+            f'# TYPE {prefix}_stage_seconds_total counter',
+        ]
+        lines += [f'{prefix}_stage_seconds_total{{stage="{name}"}} {seconds}'
+                  for name, (_, seconds) in sorted(self.stages.items())]
+        lines += [
+            f'# HELP {prefix}_stage_calls_total Number of times each processing stage ran.',
+            f'# TYPE {prefix}_stage_calls_total counter',
+        ]
+        lines += [f'{prefix}_stage_calls_total{{stage="{name}"}} {count}'
+                  for name, (count, _) in sorted(self.stages.items())]
+        for name, value in sorted(self.counters.items()):
+            lines += [f'# TYPE {prefix}_{name}_total counter', f'{prefix}_{name}_total {value}']
+        return '\n'.join(lines) + '\n'
+
+
+# metrics of this process, enabled by the server, the CLI's `--profile` option or the `PDF_TOOLS_METRICS` variable
+metrics = Metrics(enabled=os.environ.get('PDF_TOOLS_METRICS', '0') not in ('', '0'))
+
+
+def _extract_bookmarks(toc: list[list]):
+    """Helper function to convert the flat list of pymupdf's `Document.get_toc()` to nested bookmarks."""
     bookmarks = []
-    while outline:
-        bookmarks.append({
-            'label': outline.title,
-            'page': outline.page + 1
+    # the lists of subentries from the top level down to the level of the previous bookmark
+    levels = [bookmarks]
+    for level, label, page, *_ in toc:
+        del levels[level:]
+        if level > len(levels):
+            levels.append(levels[-1][-1].setdefault('subentries', []))
+        levels[-1].append({
+            'label': label,
+            'page': page
         })
-        if outline.down:
-            bookmarks[-1]['subentries'] = _extract_bookmarks(outline.down)
-
-        outline = outline.next
     return bookmarks
 
 
-def _convert_bookmarks(bookmarks: list, level=1):
+def _find_marked_content_end(stream: bytes, position: int) -> int | None:
+    """Return the end of the EMC operator closing the marked-content sequence, which starts before `position`."""
+    depth = 1
+    while token := _CONTENT_TOKEN.search(stream, position):
+        position = token.end()
+        operator = token.group()
+        if operator == b'(':
+            # skip literal strings, which may contain balanced parentheses and escaped characters
+            nesting = 1
+            while nesting:
+                delimiter = _STRING_DELIMITER.search(stream, position)
+                if delimiter is None:
+                    return None
+                position = delimiter.end()
+                if delimiter.group() == b'\\':
+                    position += 1
+                else:
+                    nesting += 1 if delimiter.group() == b'(' else -1
+        elif operator == b'ID':
+            # skip the binary data of inline images
+            end = _INLINE_IMAGE_END.search(stream, position)
+            if end is None:
+                return None
+            position = end.end()
+        elif operator in (b'BDC', b'BMC'):
+            depth += 1
+        elif operator == b'EMC':
+            depth -= 1
+            if not depth:
+                return position
+    return None
+
+
+def _strip_marked_content(stream: bytes, names: set[bytes]) -> bytes:
+    """Remove the optional content sequences `/OC /name BDC ... EMC` with the given property names from a content
+    stream. Sequences which are not closed within the stream are kept."""
+    parts = []
+    copied = 0
+    position = 0
+    while match := _OC_MARKED_CONTENT.search(stream, position):
+        position = match.end()
+        if match.group(1) not in names:
+            continue
+        end = _find_marked_content_end(stream, position)
+        if end is None:
+            break
+        parts.append(stream[copied:match.start()])
+        copied = position = end
+    if not parts:
+        return stream
+    parts.append(stream[copied:])
+    return b''.join(parts)
+
+
+def _convert_bookmarks(bookmarks: list):
     """Helper function to convert a list of bookmarks to the format expected by pymupdf's `Document.set_toc()`."""
     toc = []
-    for bookmark in bookmarks:
-        toc.append([level, bookmark['label'], bookmark['page']])
+    # iterators over the remaining bookmarks of each level
+    levels = [iter(bookmarks)]
+    while levels:
+        bookmark = next(levels[-1], None)
+        if bookmark is None:
+            levels.pop()
+            continue
+        toc.append([len(levels), bookmark['label'], bookmark['page']])
         if 'subentries' in bookmark:
-            toc += _convert_bookmarks(bookmark['subentries'], level + 1)
+            levels.append(iter(bookmark['subentries']))
+    return toc
+
+
+def inherited_key(doc, xref: int, key: str) -> tuple[int, str, str]:
+    """Look up a key of a page, which may be inherited from the parent nodes of the page tree (e.g. Resources).
+
+    Returns the xref of the page or parent node which defines the key, and its type and value as given by
+    `xref_get_key()`, which are ('null', 'null') if no node defines it.
+    """
+    while True:
+        kind, value = doc.xref_get_key(xref, key)
+        if kind != 'null':
+            return xref, kind, value
+        parent_kind, parent = doc.xref_get_key(xref, 'Parent')
+        if parent_kind != 'xref':
+            return xref, kind, value
+        xref = int(parent.split()[0])
+
+
+def dump_bookmarks_jsonl(toc: list[list], fp):
+    """Write a table of contents as JSON lines, one bookmark with its level per line."""
+    for level, label, page, *_ in toc:
+        fp.write(json.dumps({'level': level, 'label': label, 'page': page}, ensure_ascii=False) + '\n')
+
+
+def load_bookmarks_jsonl(fp) -> list[list]:
+    """Read a table of contents written by `dump_bookmarks_jsonl()`, line by line."""
+    toc = []
+    for line in fp:
+        if line.strip():
+            bookmark = json.loads(line)
+            toc.append([bookmark['level'], bookmark['label'], bookmark['page']])
     return toc
 
 
 class Document:
-    def __init__(self, filename: str, data: bytes | bytearray | io.BytesIO):
+    def __init__(self, filename: str, data: bytes | bytearray | io.BytesIO | None = None,
+                 path: str | Path | None = None, save_profile: str = DEFAULT_SAVE_PROFILE):
+        """Open a document from `data` or, if no data is given, lazily from the file at `path` (default: `filename`)."""
+        if save_profile not in SAVE_PROFILES:
+            raise ValueError(f'unknown save profile "{save_profile}", expected one of {list(SAVE_PROFILES)}')
+
         self.file = Path(filename)
+        self.path = Path(path or filename) if data is None else None
+        self.save_profile = save_profile
+        # changed dictionary keys as (xref, key, value) and replaced objects as (xref, None, source), which can be
+        # replayed for an incremental save, None after changes that are not recorded
+        self.changes: list[tuple[int, str, str]] | None = []
         try:
+            import pymupdf
+
             if self.file.suffix.lower() != '.pdf':
                 raise ValueError('given filename must end with ".pdf"')
 
-            if not isinstance(data, (bytes, bytearray, io.BytesIO)):
-                raise TypeError('stream must be bytes, bytearray or io.BytesIO')
+            with metrics.stage('open'):
+                if data is None:
+                    open_arguments = {'filename': str(self.path)}
+                else:
+                    if not isinstance(data, (bytes, bytearray, io.BytesIO)):
+                        raise TypeError('stream must be bytes, bytearray or io.BytesIO')
+                    open_arguments = {'stream': data, 'filename': self.file.name}
 
-            self.doc = fitz.Document(stream=data, filename=self.file.name)
+                try:
+                    self.doc = pymupdf.Document(**open_arguments)
+                except pymupdf.FileDataError as e:
+                    # the message of PyMuPDF names the path, which is a temporary file for uploads
+                    raise ValueError(f'"{self.file.name}" is not a valid PDF document') from e
             self.permissions = self.doc.permissions
+
+            if metrics.enabled:
+                metrics.add('documents')
+                metrics.add('bytes_in', os.path.getsize(self.path) if data is None else len(
+                    data.getbuffer() if isinstance(data, io.BytesIO) else data))
+                metrics.add('pages', self.doc.page_count)
         except Exception as e:
             logging.error(f'Failed to create document: {e}')
+            raise
+
+    def remove_watermarks(self, strip_content: bool = False):
+        """Turn off the view, print and export usage of all optional content groups (OCGs) of all layer configurations.
+        With `strip_content`, their content is also removed from the pages, so it can't be turned on again."""
+        with metrics.stage('remove_watermarks'):
+            ocgs = self._get_ocgs()
+            if not ocgs:
+                logging.debug(f'No watermarks were found in "{str(self.file)}".')
+                return
+            metrics.add('ocgs', len(ocgs))
 
-    def remove_watermarks(self):
-        ocgs = set()
+            # usage dictionaries may be indirect objects, which are shared by several OCGs
+            usages = set()
+            for ocg in sorted(ocgs):
+                source = self.doc.xref_object(ocg, compressed=True)
+                if match := _INDIRECT_USAGE.search(source):
+                    usages.add(int(match.group(1)))
+                self._turn_off_usage(ocg, source)
+            for usage in sorted(usages):
+                self._turn_off_usage(usage, self.doc.xref_object(usage, compressed=True))
+
+            if strip_content:
+                self._strip_optional_content(ocgs)
+
+    def _get_ocgs(self) -> set[int]:
+        """Read the OCGs of the document, which are listed once for the default and all alternate layer configurations
+        in the catalog. This is a single lookup instead of walking the arrays of each configuration."""
         try:
-            for key in ['on', 'off']:
-                if key in self.doc.get_layer(-1):
-                    ocgs.update(self.doc.get_layer(-1)[key])
-        except BaseException:
-            pass
-
-        if not ocgs:
-            logging.debug(f'No watermarks were found in "{str(self.file)}".')
-            return
+            kind, ocgs = self.doc.xref_get_key(self.doc.pdf_catalog(), 'OCProperties/OCGs')
+        except Exception:
+            return set()
+        if kind == 'xref':
+            ocgs = self.doc.xref_object(int(ocgs.split()[0]), compressed=True)
+        elif kind != 'array':
+            return set()
+        return {int(xref) for xref in _REFERENCE.findall(ocgs)}
+
+    def _turn_off_usage(self, xref: int, source: str):
+        # only objects with a changed state are written
+        new_source = _USAGE_STATE_ON.sub(r'\1/OFF', source)
+        if new_source != source:
+            self.update_object(xref, new_source)
+
+    def _strip_optional_content(self, ocgs: set[int]):
+        """Remove the content of the OCGs from the pages: marked-content sequences of the page content streams and form
+        XObjects which belong to one of the OCGs as a whole (/OC key). Content that belongs to optional content
+        membership dictionaries (OCMDs), marked content within form XObjects and image XObjects with an /OC key are only
+        turned off."""
+        stripped = set()
+        for page in self.doc:
+            for xref, *_ in page.get_xobjects():
+                if xref in stripped:
+                    continue
+                stripped.add(xref)
+                kind, oc = self.doc.xref_get_key(xref, 'OC')
+                if kind == 'xref' and int(oc.split()[0]) in ocgs \
+                        and self.doc.xref_get_key(xref, 'Subtype') == ('name', '/Form'):
+                    self.doc.update_stream(xref, b'')
+                    self.changes = None
+
+            # the resources may be inherited from a parent node of the page tree
+            resources_node, _, _ = inherited_key(self.doc, page.xref, 'Resources')
+            kind, properties = self.doc.xref_get_key(resources_node, 'Resources/Properties')
+            if kind == 'xref':
+                properties = self.doc.xref_object(int(properties.split()[0]), compressed=True)
+            elif kind != 'dict':
+                continue
+            names = {name.encode() for name, xref in _PROPERTY_REFERENCE.findall(properties) if int(xref) in ocgs}
+            if not names:
+                continue
 
-        for ocg in ocgs:
-            variable_type, ocg_settings = self.doc.xref_get_key(ocg, 'Usage')
-            ocg_settings = ocg_settings.replace('/ON', '/OFF')
-            self.doc.xref_set_key(ocg, 'Usage', ocg_settings)
+            for xref in page.get_contents():
+                if xref in stripped:
+                    continue
+                stripped.add(xref)
+                stream = self.doc.xref_stream(xref)
+                new_stream = _strip_marked_content(stream, names)
+                if len(new_stream) != len(stream):
+                    self.doc.update_stream(xref, new_stream)
+                    # streams are not recorded for incremental saves
+                    self.changes = None
+
+    def set_key(self, xref: int, key: str, value: str):
+        """Set a dictionary key of a PDF object and record the change for incremental saves."""
+        self.doc.xref_set_key(xref, key, value)
+        if self.changes is not None:
+            self.changes.append((xref, key, value))
+
+    def update_object(self, xref: int, source: str):
+        """Replace a PDF object by its new source and record the change for incremental saves."""
+        self.doc.update_object(xref, source)
+        if self.changes is not None:
+            self.changes.append((xref, None, source))
 
     def update_permissions(self, value):
         self.permissions = value
@@ -90,14 +425,260 @@ class Document:
         self.update_permissions(ALL_PERMISSIONS_GRANTED)
 
     def update_bookmarks(self, new_bookmarks: list[dict]):
-        self.doc.set_toc(_convert_bookmarks(new_bookmarks))
+        self.update_toc(_convert_bookmarks(new_bookmarks))
 
     def get_bookmarks(self):
-        return _extract_bookmarks(self.doc.outline)
+        return _extract_bookmarks(self.get_toc())
+
+    def update_toc(self, toc: list[list]):
+        """Replace the bookmarks by a flat table of contents of [level, label, page] entries."""
+        with metrics.stage('update_bookmarks'):
+            self.doc.set_toc(toc)
+        self.changes = None
+
+    def get_toc(self) -> list[list]:
+        return self.doc.get_toc(simple=True)
+
+    def select_pages(self, pages: list[int]):
+        """Keep only the given pages (0-based, ascending). Bookmarks to removed pages point to the next kept page."""
+        toc = self.doc.get_toc()
+        kept_pages = sorted(pages)
+        for entry in toc:
+            # bookmark pages are 1-based, pages < 1 have no target
+            if entry[2] >= 1:
+                position = min(bisect.bisect_left(kept_pages, entry[2] - 1), len(kept_pages) - 1)
+                entry[2] = position + 1
+
+        with metrics.stage('select_pages'):
+            self.doc.select(kept_pages)
+            self.doc.set_toc(toc)
+        self.changes = None
+
+    def can_save_incrementally(self) -> bool:
+        """Whether all changes can be appended to the original file, which requires a document opened from a path,
+        only recorded changes and, for encrypted documents, unchanged permissions (as they are part of the encryption)."""
+        return self.path is not None \
+            and self.changes is not None \
+            and (self.permissions == self.doc.permissions or not self.doc.metadata.get('encryption')) \
+            and self.doc.can_save_incrementally()
+
+    def _to_bytes_incrementally(self):
+        import pymupdf
+
+        with tempfile.TemporaryDirectory() as directory:
+            target = Path(directory) / self.file.name
+            shutil.copyfile(self.path, target)
+            with pymupdf.Document(str(target)) as doc:
+                for xref, key, value in self.changes:
+                    if key is None:
+                        doc.update_object(xref, value)
+                    else:
+                        doc.xref_set_key(xref, key, value)
+                doc.save(str(target), incremental=True, encryption=pymupdf.PDF_ENCRYPT_KEEP)
+            return target.read_bytes()
 
     def to_bytes(self):
-        return self.doc.tobytes(garbage=3, clean=True, deflate=True,
-                                permissions=self.permissions)
+        with metrics.stage('save'):
+            content = self._to_bytes()
+        if metrics.enabled:
+            metrics.add('bytes_out', len(content))
+            metrics.add('objects', self.doc.xref_length() - 1)
+        return content
+
+    def _to_bytes(self):
+        options = SAVE_PROFILES[self.save_profile]
+        if options.get('incremental'):
+            if self.can_save_incrementally():
+                return self._to_bytes_incrementally()
+            logging.debug(f'Cannot save "{str(self.file)}" incrementally, using the "{INCREMENTAL_FALLBACK_PROFILE}" profile.')
+            options = SAVE_PROFILES[INCREMENTAL_FALLBACK_PROFILE]
+        return self.doc.tobytes(**options, permissions=self.permissions)
 
     def to_bytesIO(self):
         return io.BytesIO(self.to_bytes())
+
+
+def process_document(filename: str, data: bytes | bytearray | io.BytesIO | None = None, actions: list[str] = (),
+                     path: str | Path | None = None, save_profile: str = DEFAULT_SAVE_PROFILE) -> bytes:
+    """Apply the given actions to a document and return the saved result. Picklable entry point for worker processes."""
+    doc = Document(filename=filename, data=data, path=path, save_profile=save_profile)
+    try:
+        for action in actions:
+            if action == 'remove_watermarks':
+                doc.remove_watermarks()
+            elif action == 'strip_watermarks':
+                doc.remove_watermarks(strip_content=True)
+            elif action == 'unlock_permissions':
+                doc.unlock_permissions()
+        return doc.to_bytes()
+    finally:
+        doc.doc.close()
+
+
+def process_document_with_metrics(*args, **kwargs) -> tuple[bytes, dict]:
+    """Like `process_document()`, but also return a snapshot of the metrics recorded by this process meanwhile."""
+    metrics.reset()
+    try:
+        return process_document(*args, **kwargs), metrics.snapshot()
+    finally:
+        metrics.reset()
+
+
+def init_worker(metrics_enabled: bool = False):
+    """Initializer for worker processes, which enables their metrics and warms them up."""
+    metrics.enabled = metrics_enabled
+    warm_up()
+
+
+def warm_up():
+    """Exercise PyMuPDF once, so the first real document in a fresh worker process does not pay for the setup."""
+    import pymupdf
+
+    doc = pymupdf.Document()
+    doc.new_page()
+    doc.tobytes(garbage=3, clean=True, deflate=True)
+    doc.close()
+
+
+def content_digest(data: bytes | bytearray | io.BytesIO) -> str:
+    """Return the SHA-256 hex digest of a document's content, as used for `ResultCache.key()`."""
+    if isinstance(data, io.BytesIO):
+        data = data.getbuffer()
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path: str | Path) -> str:
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with metrics.stage('digest'), open(path, 'rb') as fp:
+        while chunk := fp.read(2**20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Content-addressed cache for processed documents.
+
+    Results are kept in an in-memory LRU tier and, if a directory is given, in an on-disk tier shared between
+    processes. Both tiers evict the least recently used entries once their size limit is exceeded.
+    """
+
+    def __init__(self, max_memory_bytes: int = 256 * 2**20, directory: str | Path | None = None,
+                 max_disk_bytes: int = 2 * 2**30):
+        self.max_memory_bytes = max_memory_bytes
+        self.memory: OrderedDict[str, bytes] = OrderedDict()
+        self.memory_bytes = 0
+
+        self.directory = Path(directory) if directory else None
+        self.max_disk_bytes = max_disk_bytes
+        # size of the on-disk tier, which is counted once and then tracked by the stores of this process,
+        # the stores of other processes sharing the directory are counted whenever entries are evicted
+        self.disk_bytes = 0
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+        self.eviction_lock = threading.Lock()
+
+    @staticmethod
+    def key(digest: str, actions: list[str], save_options: dict | None = None) -> str:
+        """Combine the input digest, the ordered actions and the save options to a cache key, which also depends on
+        the cache version and the PyMuPDF version, as both change the results."""
+        import pymupdf
+
+        description = json.dumps([CACHE_VERSION, pymupdf.VersionBind, digest, list(actions), save_options or {}],
+                                 sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return self.memory[key]
+
+        if self.directory:
+            path = self.directory / f'{key}.pdf'
+            try:
+                content = path.read_bytes()
+                os.utime(path)  # mark as recently used for the eviction
+            except FileNotFoundError:
+                pass
+            else:
+                with self.lock:
+                    self.stats['disk_hits'] += 1
+                self._store_in_memory(key, content)
+                return content
+
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key: str, content: bytes):
+        with self.lock:
+            self.stats['stores'] += 1
+        self._store_in_memory(key, content)
+
+        if self.directory:
+            path = self.directory / f'{key}.pdf'
+            # write to a temporary file first, so that other processes never read partial entries
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(content)
+            try:
+                replaced_bytes = path.stat().st_size
+            except FileNotFoundError:
+                replaced_bytes = 0
+            os.replace(temp_path, path)
+
+            with self.lock:
+                self.disk_bytes += len(content) - replaced_bytes
+                full = self.disk_bytes > self.max_disk_bytes
+            if full:
+                self._evict_from_disk()
+
+    def _store_in_memory(self, key: str, content: bytes):
+        if len(content) > self.max_memory_bytes:
+            return
+        with self.lock:
+            if key in self.memory:
+                self.memory_bytes -= len(self.memory.pop(key))
+            self.memory[key] = content
+            self.memory_bytes += len(content)
+            while self.memory_bytes > self.max_memory_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def _disk_entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        for path in self.directory.glob('*.pdf'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # removed by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict_from_disk(self):
+        # the directory is only scanned once the limit is exceeded, the least recently used entries are then evicted
+        # down to 90% of the limit, so that the next scan is not necessary after a few more stores
+        with self.eviction_lock:
+            with self.lock:
+                tracked_bytes = self.disk_bytes
+            entries = self._disk_entries()
+            disk_bytes = sum(size for _, size, _ in entries)
+            evictions = 0
+            for _, size, path in sorted(entries):
+                if disk_bytes <= 0.9 * self.max_disk_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                disk_bytes -= size
+                evictions += 1
+
+            with self.lock:
+                # keep the stores which happened during the scan
+                self.disk_bytes += disk_bytes - tracked_bytes
+                self.stats['evictions'] += evictions
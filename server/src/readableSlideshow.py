@@ -1,17 +1,27 @@
 import argparse
-import matplotlib.pyplot as plt
-import multiprocessing
+import collections
+import hashlib
 import numpy as np
+import os
 import pathlib
-import PyPDF2
-import scipy.cluster
 import subprocess
-from bs4 import BeautifulSoup
-from pdf2image import convert_from_path
-from tqdm.contrib.concurrent import process_map
+import tempfile
+
+# matplotlib, scipy, bs4, PIL, pdf2image, PyPDF2 and tqdm are imported by the functions that need them,
+# so that a mode only pays for the imports it uses
+
+from pdf_tools_core import DEFAULT_SAVE_PROFILE, SAVE_PROFILES, Document, inherited_key
+
+# PyMuPDF is optional, without it the pages are rendered with poppler and the text is extracted with pdf2htmlEX
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
 
 
 def drawColorFrequency(colors, frequency):
+    import matplotlib.pyplot as plt
+
     total = frequency.sum()
     for i in range(len(frequency)):
         plt.scatter(i, frequency[i], color=colors[i]/255, edgecolors='b', s=1000, marker='s')
@@ -20,13 +30,15 @@ def drawColorFrequency(colors, frequency):
     plt.yscale('log')
     plt.show()
 
-def getMostFrequentColor(image, maxColors=8):
+def getMostFrequentColorKmeans(image, maxColors=8):
+    import scipy.cluster.vq
+
     data = np.array(image)
     # reformat data to list of pixels, shape: (#pixel, 1) or (#pixel, 3)
     if len(data.shape) == 2:
-        pixels = data.reshape(np.product(data.shape[:2]), 1).astype(float)
+        pixels = data.reshape(np.prod(data.shape[:2]), 1).astype(float)
     elif len(data.shape) == 3:
-        pixels = data.reshape(np.product(data.shape[:2]), data.shape[2]).astype(float)
+        pixels = data.reshape(np.prod(data.shape[:2]), data.shape[2]).astype(float)
 
     # choose <maxColors> colors that represent the image best
     codebook, _ = scipy.cluster.vq.kmeans2(pixels, maxColors, minit='++')
@@ -44,53 +56,308 @@ def getMostFrequentColor(image, maxColors=8):
     color = codebook[iMax]
     return color
 
-def readableSlideshowImg(filename, resolution=80, firstPage=None, lastPage=None, maxColorDetection=8, overwriteBackgroundColor=None, queue=None):
-    # load pages
-    pages = convert_from_path(filename, resolution, first_page=firstPage, last_page=lastPage, grayscale=False)
+def getMostFrequentColorHistogram(image, step=4, bits=5):
+    # only look at every <step>th pixel in both directions, shape: (#pixel, #channels)
+    data = np.asarray(image)[::step, ::step]
+    if len(data.shape) == 2:
+        data = data[..., np.newaxis]
+    pixels = data.reshape(-1, data.shape[2])
+
+    # quantize each channel to <bits> bits and pack the channels into one integer per pixel,
+    # so that the colors can be counted with a single bincount
+    shift = 8 - bits
+    high = pixels >> shift
+    packed = np.zeros(len(pixels), dtype=np.int64)
+    for channel in range(pixels.shape[1]):
+        packed = (packed << bits) | high[:, channel]
+    mostFrequentBin = np.bincount(packed).argmax()
+
+    # the exact most frequent color within the most frequent bin, counted by the remaining lower bits
+    members = pixels[packed == mostFrequentBin]
+    low = members & ((1 << shift) - 1)
+    packedLow = np.zeros(len(members), dtype=np.int64)
+    for channel in range(pixels.shape[1]):
+        packedLow = (packedLow << shift) | low[:, channel]
+    color = members[packedLow == np.bincount(packedLow).argmax()][0]
+    return color.astype(float)
+
+def getMostFrequentColor(image, maxColors=8, method='histogram'):
+    if method == 'kmeans':
+        return getMostFrequentColorKmeans(image, maxColors=maxColors)
+    return getMostFrequentColorHistogram(image)
+
+class BackgroundColorCache:
+    # consecutive slides usually share their template and therefore their background color,
+    # so the estimate is reused as long as the border of the slides stays the same
+    def __init__(self, maxColors=8, method='histogram'):
+        self.maxColors = maxColors
+        self.method = method
+        self.signature = None
+        self.color = None
+
+    def __call__(self, image):
+        signature = b''.join(np.ascontiguousarray(border).tobytes() for border in (image[0], image[-1], image[:, 0], image[:, -1]))
+        if signature != self.signature:
+            self.signature = signature
+            self.color = getMostFrequentColor(image, maxColors=self.maxColors, method=self.method)
+        return self.color
+
+def parseColor(colorHex):
+    # "#rrggbb" to an array of the channel values
+    colorHex = colorHex.lstrip('#')
+    return np.array([int(colorHex[i:i+2], 16) for i in range(0, len(colorHex), 2)])
+
+def renderPage(page, resolution):
+    # render a page in-process, the array uses the sample buffer of the pixmap without copying it
+    # the pixmap is returned as well, since it owns the memory and has to be kept alive as long as the array
+    zoom = resolution / 72
+    pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), colorspace=pymupdf.csRGB, alpha=False)
+    return pixmap, np.frombuffer(pixmap.samples_mv, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+
+
+class PdfPage:
+    # a page with cheap fingerprints (content hash, text, thumbnail), each computed on first use
+    # the full resolution image is only rendered if the fingerprints can't decide a comparison
+    def __init__(self, page, resolution, thumbnailResolution=None):
+        self.page = page
+        self.resolution = resolution
+        self.thumbnailResolution = thumbnailResolution if thumbnailResolution and thumbnailResolution < resolution else None
+        self._contentHash = self._text = self._thumbnail = self._image = None
+
+    @property
+    def contentHash(self):
+        # pages with the same content streams, resources, annotations and dimensions render identically
+        # annotations are referenced by the page, so only pages sharing the same annotation objects get the same hash
+        if self._contentHash is None:
+            doc = self.page.parent
+            description = [self.page.read_contents(), inherited_key(doc, self.page.xref, 'Resources')[2].encode(),
+                           doc.xref_get_key(self.page.xref, 'Annots')[1].encode(),
+                           str(self.page.rect).encode(), str(self.page.rotation).encode()]
+            self._contentHash = hashlib.sha256(b'\0'.join(description)).digest()
+        return self._contentHash
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.page.get_text()
+        return self._text
+
+    @property
+    def thumbnail(self):
+        if self._thumbnail is None and self.thumbnailResolution:
+            self._thumbnail = renderPage(self.page, self.thumbnailResolution)
+        return self._thumbnail[1] if self._thumbnail else None
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = renderPage(self.page, self.resolution)
+        return self._image[1]
+
+
+class RenderedPage:
+    # a page rendered by an external renderer, without fingerprints
+    contentHash = text = thumbnail = None
+
+    def __init__(self, image):
+        self.image = image
+
+
+def iterPdfPages(filename, resolution=80, firstPage=None, lastPage=None, thumbnailResolution=None):
+    with pymupdf.open(filename) as doc:
+        first = (firstPage or 1) - 1
+        last = min(lastPage or doc.page_count, doc.page_count)
+        for number in range(first, last):
+            yield PdfPage(doc[number], resolution, thumbnailResolution)
+
+
+def renderPagesPoppler(filename, resolution=80, firstPage=None, lastPage=None):
+    # render the pages with poppler's pdftoppm, which runs as a subprocess and writes the pages to temporary files
+    # these are only loaded one at a time
+    from pdf2image import convert_from_path
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as outputFolder:
+        paths = convert_from_path(filename, resolution, outputFolder, first_page=firstPage, last_page=lastPage, grayscale=False, paths_only=True)
+        for path in sorted(paths):
+            with Image.open(path) as image:
+                yield RenderedPage(np.array(image.convert('RGB')))
+
+
+def hasVanishingContent(curr, next, bgColor, changed, visible):
+    # compare the current slide to the next: a pixel (channel) counts if it differs from the next slide
+    # and is not background colored in the current slide, i.e. content that is not shown on the next slide anymore
+    # in case that there was only information added (e.g. a new sentence) no pixel counts
+    # same as np.where(curr == next, curr, np.full_like(curr, bgColor)) != curr, but using the preallocated masks
+    np.not_equal(curr, next, out=changed)
+    np.not_equal(curr, np.asarray(bgColor).astype(curr.dtype), out=visible)
+    np.logical_and(changed, visible, out=changed)
+    return changed.any()
+
+
+def changedTiles(thumbCurr, thumbNext, shape, tileSize=4):
+    # map the tiles in which the thumbnails differ to (slightly enlarged) regions of the full resolution image
+    diff = (thumbCurr != thumbNext).any(axis=2)
+    height, width = diff.shape
+    rows, columns = -(-height // tileSize), -(-width // tileSize)
+    padded = np.zeros((rows * tileSize, columns * tileSize), dtype=bool)
+    padded[:height, :width] = diff
+    tiles = padded.reshape(rows, tileSize, columns, tileSize).any(axis=(1, 3))
+
+    regions = list()
+    for row, column in np.argwhere(tiles):
+        y0 = max(0, (row * tileSize - 1) * shape[0] // height)
+        y1 = min(shape[0], -(-((row + 1) * tileSize + 1) * shape[0] // height))
+        x0 = max(0, (column * tileSize - 1) * shape[1] // width)
+        x1 = min(shape[1], -(-((column + 1) * tileSize + 1) * shape[1] // width))
+        regions.append((slice(y0, y1), slice(x0, x1)))
+    return regions
+
+
+class PageComparator:
+    # decides whether a page is needed in tiers, from cheap to expensive:
+    # identical content streams, identical thumbnails, pixel diff of changed tiles, full pixel diff
+    # the text is not used, since words can be invisible (e.g. OCR layers) or hidden behind other content
+    tiers = ['content', 'thumbnail', 'tiles', 'full']
+
+    def __init__(self, maxColorDetection=8, overwriteBackgroundColor=None, colorMethod='histogram', stats=None):
+        self.overwriteBackgroundColor = overwriteBackgroundColor
+        self.backgroundColor = BackgroundColorCache(maxColorDetection, colorMethod)
+        # number of page pairs resolved by each tier
+        self.stats = stats if stats is not None else dict()
+        for tier in self.tiers:
+            self.stats.setdefault(tier, 0)
+        # comparison masks, which are reused for all pages of the same size
+        self.changed = self.visible = None
+
+    def isNeeded(self, curr, next):
+        # a slide is not needed if it contains a subset of information in regards to the next slide (slideshow revealing one aspect at a time)
+        if curr.contentHash is not None and curr.contentHash == next.contentHash:
+            self.stats['content'] += 1
+            return False
+
+        regions = None
+        thumbCurr, thumbNext = curr.thumbnail, next.thumbnail
+        if thumbCurr is not None and thumbCurr.shape == thumbNext.shape:
+            if np.array_equal(thumbCurr, thumbNext):
+                self.stats['thumbnail'] += 1
+                return False
+            regions = changedTiles(thumbCurr, thumbNext, curr.image.shape)
+
+        currImage, nextImage = curr.image, next.image
+        if currImage.shape != nextImage.shape:
+            # differently sized pages can't be compared
+            self.stats['full'] += 1
+            return True
+
+        if self.changed is None or self.changed.shape != currImage.shape:
+            self.changed = np.empty(currImage.shape, dtype=bool)
+            self.visible = np.empty(currImage.shape, dtype=bool)
 
-    neededSlides = list()
+        # most frequent color is probably background color
+        bgColor = self.overwriteBackgroundColor
+        if bgColor is None:
+            bgColor = self.backgroundColor(currImage)
 
-    for i in range(len(pages) - 1):
-        curr = np.array(pages[i])
-        next = np.array(pages[i+1])
+        if regions is None:
+            self.stats['full'] += 1
+            return hasVanishingContent(currImage, nextImage, bgColor, self.changed, self.visible)
 
-        # most frequent color is probably background color
-        bgColor = overwriteBackgroundColor
-        if overwriteBackgroundColor is None:
-            bgColor = getMostFrequentColor(curr, maxColors=maxColorDetection)
-
-        # compare the current slide to the next and fill the pixel that are different with the background color
-        # in case that there was only information added (e.g. a new sentence) these pixels revert to the first image ("curr")
-        # and the image "diff" should be the same as the image "curr"
-        diff = np.where(curr == next, curr, np.full_like(curr, bgColor))
-        
-        # a slide is not needed if it contains a subset of information in regards to the next slide (slideshow revealing one aspect at a time)
-        if (curr != diff).any():
+        self.stats['tiles'] += 1
+        return any(hasVanishingContent(currImage[region], nextImage[region], bgColor, self.changed[region], self.visible[region])
+                   for region in regions)
+
+
+def readableSlideshowImg(filename, resolution=80, firstPage=None, lastPage=None, maxColorDetection=8, overwriteBackgroundColor=None, renderer='pymupdf', colorMethod='histogram', thumbnailResolution=20, stats=None):
+    if renderer == 'pymupdf' and pymupdf is None:
+        print('* INFO: PyMuPDF is not installed, using poppler to render the pages')
+        renderer = 'poppler'
+
+    # pages are rendered one at a time, only the current and the next page are kept in memory
+    if renderer == 'pymupdf':
+        pages = iterPdfPages(filename, resolution, firstPage, lastPage, thumbnailResolution)
+    else:
+        pages = renderPagesPoppler(filename, resolution, firstPage, lastPage)
+    comparator = PageComparator(maxColorDetection, overwriteBackgroundColor, colorMethod, stats)
+
+    neededSlides = list()
+    i = (firstPage or 1) - 2  # index of the previous page, first page of original pdf is 0 not 1
+    curr = None
+    for next in pages:
+        if curr is not None and comparator.isNeeded(curr, next):
             neededSlides.append(i)
+        curr = next
+        i += 1
 
-    neededSlides.append(len(pages) - 1)
-    if queue is not None:
-        queue.put(neededSlides)
+    neededSlides.append(i)
+    return neededSlides # first page of original pdf is 0 not 1
+
+
+def readableSlideshowBoth(filename, resolution=80, firstPage=None, lastPage=None, maxColorDetection=8, overwriteBackgroundColor=None, colorMethod='histogram', thumbnailResolution=20, stats=None):
+    # combination of readableSlideshowText and readableSlideshowImg in a single pass over the document:
+    # a page is only needed if both its text and its image differ, so pages are only compared as images
+    # (and rendered) if their text differs
+    comparator = PageComparator(maxColorDetection, overwriteBackgroundColor, colorMethod, stats)
+    comparator.stats.setdefault('sameText', 0)
+
+    neededSlides = list()
+    i = (firstPage or 1) - 2  # index of the previous page, first page of original pdf is 0 not 1
+    curr = None
+    for next in iterPdfPages(filename, resolution, firstPage, lastPage, thumbnailResolution):
+        if curr is not None:
+            if curr.text == next.text:
+                comparator.stats['sameText'] += 1
+            elif comparator.isNeeded(curr, next):
+                neededSlides.append(i)
+        curr = next
+        i += 1
+
+    neededSlides.append(i)
     return neededSlides # first page of original pdf is 0 not 1
 
 
-def readableSlideshowHtml(filename, firstPage=None, lastPage=None, queue=None):
-    # create pdf2htmlex commandline parameters
-    parameters = ['pdf2htmlEX', '--dpi', '0', '--dest-dir', filename.parent]
-    if firstPage is not None:
-        parameters += ['-f', str(firstPage)]
-    if lastPage is not None:
-        parameters += ['-l', str(lastPage)]
-    parameters += [filename]
-    # generate html
-    subprocess.run(parameters, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-    # load html
-    html = None
-    with open(filename.with_suffix('.html')) as f:
-        html = BeautifulSoup(f, 'html.parser')
+def readableSlideshowText(filename, firstPage=None, lastPage=None):
+    # same selection as readableSlideshowHtml, but with the text extracted in-process page by page
+    neededSlides = list()
+    with pymupdf.open(filename) as doc:
+        first = (firstPage or 1) - 1
+        last = min(lastPage or doc.page_count, doc.page_count)
+
+        i = (firstPage or 1) - 2  # index of the previous page, first page of original pdf is 0 not 1
+        curr = None
+        for number in range(first, last):
+            next = doc[number].get_text()
+            if curr is not None and curr != next:
+                neededSlides.append(i)
+            curr = next
+            i += 1
+    neededSlides.append(i)
+
+    return neededSlides # first page of original pdf is 0 not 1
+
+
+def readableSlideshowHtml(filename, firstPage=None, lastPage=None):
+    from bs4 import BeautifulSoup
+
+    # the html file is written to a temporary directory, so that jobs for the same directory do not interfere
+    with tempfile.TemporaryDirectory() as destDir:
+        # create pdf2htmlex commandline parameters
+        parameters = ['pdf2htmlEX', '--dpi', '0', '--dest-dir', destDir]
+        if firstPage is not None:
+            parameters += ['-f', str(firstPage)]
+        if lastPage is not None:
+            parameters += ['-l', str(lastPage)]
+        parameters += [filename]
+        # generate html
+        subprocess.run(parameters, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        # load html
+        html = None
+        with open(pathlib.Path(destDir) / filename.with_suffix('.html').name) as f:
+            html = BeautifulSoup(f, 'html.parser')
     pages = list(html.select('#page-container > div'))
     
     neededSlides = list()
+    offset = (firstPage or 1) - 1
     # determine whether a slide is needed or not
     for i in range(len(pages) - 1):
         curr = pages[i]
@@ -100,27 +367,34 @@ def readableSlideshowHtml(filename, firstPage=None, lastPage=None, queue=None):
         # but then hides the elements that are not shown yet
         # probably due to underlying structure in the pdf
         if curr.text != next.text:
-            neededSlides.append(i)
-    neededSlides.append(len(pages) - 1)
+            neededSlides.append(offset + i)
+    neededSlides.append(offset + len(pages) - 1)
 
-    filename.with_suffix('.html').unlink()  # delete .html file
-    if queue is not None:
-        queue.put(neededSlides)
     return neededSlides # first page of original pdf is 0 not 1
 
 
-def saveRelevantPages(file, relevantPages, outputPrefix='readable_'):
+def saveRelevantPages(file, relevantPages, outputPrefix='readable_', saveProfile=DEFAULT_SAVE_PROFILE):
+    outputFile = file.parent / (outputPrefix + file.name)
 
-    pdf = PyPDF2.PdfFileReader(str(file))
-    pdfWriter = PyPDF2.PdfFileWriter()
+    if pymupdf is None:
+        # slow fallback, which copies the pages one by one
+        import PyPDF2
+        pdf = PyPDF2.PdfReader(str(file))
+        pdfWriter = PyPDF2.PdfWriter()
+        for page in relevantPages:
+            pdfWriter.add_page(pdf.pages[page])
+        with open(outputFile, 'wb') as f:
+            pdfWriter.write(f)
+        return
 
-    # add relevant pages
-    for page in relevantPages:
-        pdfWriter.addPage(pdf.getPage(page))
-    
-    # save with new name
-    with open(file.parent / (outputPrefix + file.name), 'wb') as f:
-        pdfWriter.write(f)
+    # select the pages within the document, which keeps shared resources shared and remaps the bookmarks
+    document = Document(filename=file, save_profile=saveProfile)
+    try:
+        document.select_pages(relevantPages)
+        with open(outputFile, 'wb') as f:
+            f.write(document.to_bytes())
+    finally:
+        document.doc.close()
 
 
 def parse(fixedString=None):
@@ -133,10 +407,18 @@ def parse(fixedString=None):
     parser.add_argument('file', metavar='FILE', type=str, nargs='+', help='a pdf file or folder to process')
     parser.add_argument('-r', '--resolution', '--dpi', metavar='DPI', type=int, help='resolution in dpi while scanning the pdf (default: 80)', default=80)
     parser.add_argument('-o', '--output', metavar='OUT', type=str, help='a prefix for the output filename (default: "readable_")', default='readable_')
+    parser.add_argument('-j', '--jobs', metavar='NUM', type=int, help='number of worker processes, which is the total number of processes used (default: number of CPUs)', default=os.cpu_count())
+    parser.add_argument('--shardSize', metavar='NUM', type=int, help='split files into parts of this many pages, which are processed in parallel, 0 disables the splitting (default: 100)', default=100)
     parser.add_argument('--first', metavar='NUM', type=int, help='first page to read in (default: 1)')
     parser.add_argument('--last', metavar='NUM', type=int, help='last page to read in (default: MAX)')
+    parser.add_argument('--saveProfile', type=str, choices=list(SAVE_PROFILES), help=f'trade-off between saving time and file size of the output (default: {DEFAULT_SAVE_PROFILE})', default=DEFAULT_SAVE_PROFILE)
     parser.add_argument('-m', '--mode', type=str, help='mode for relevant pages detection (IMG, HTML or BOTH, default: BOTH)', default='BOTH')
-    parser.add_argument('--maxColors', metavar='NUM', type=int, help='amount of colors used in clustering to find the background color, for mode IMG (default: 8)', default=8)
+    parser.add_argument('--textBackend', type=str, choices=['pymupdf', 'pdf2htmlEX'], help='backend for the text extraction, for mode HTML (default: pymupdf, pdf2htmlEX if PyMuPDF is not installed)', default='pymupdf')
+    parser.add_argument('--renderer', type=str, choices=['pymupdf', 'poppler'], help='renderer for the pages, for mode IMG (default: pymupdf, poppler if PyMuPDF is not installed)', default='pymupdf')
+    parser.add_argument('--thumbnailDpi', metavar='DPI', type=int, help='resolution of the thumbnails used to skip identical pages and to limit the pixel comparison to changed regions, 0 disables them, for mode IMG (default: 20)', default=20)
+    parser.add_argument('--stats', action='store_true', help='print how many page pairs were decided by each comparison tier, for mode IMG')
+    parser.add_argument('--colorMethod', type=str, choices=['histogram', 'kmeans'], help='method to find the background color, for mode IMG (default: histogram)', default='histogram')
+    parser.add_argument('--maxColors', metavar='NUM', type=int, help='amount of colors used in clustering to find the background color, for mode IMG and color method kmeans (default: 8)', default=8)
     parser.add_argument('-obgc', '--overwriteBackgroundColor', metavar='COLORHEX', type=str, help='use this color as background color and skip background color calculation, for mode IMG (like "-obgc #ffffff")')
 
     if fixedString:
@@ -172,6 +454,9 @@ def checkArguments(args):
     if args.first is not None and args.last is not None and args.first >= args.last:
         raise ValueError(f'The page numbers do not fit together: first ({args.first}) must be smaller than last ({args.last})')
 
+    if args.shardSize and args.shardSize < 2:
+        raise ValueError(f'A shard needs at least two pages to compare, not {args.shardSize}')
+
     if args.overwriteBackgroundColor and args.maxColors != 8:
         print('* INFO: "--maxColors MAXCOLORS" is ignored due to "--overwriteBackgroundColor COLORHEX" being set')
     
@@ -179,44 +464,82 @@ def checkArguments(args):
         raise Exception('Either leave out the mode argument or specify any of these modes: IMG or HTML')
 
 
+def shardPageRanges(file, args):
+    # split the selected pages into ranges of <shardSize> pages, which overlap by one page,
+    # so that the pairs at the boundaries are compared as well
+    if not args.shardSize or pymupdf is None:
+        return [(args.first, args.last)]
+    with pymupdf.open(file) as doc:
+        pageCount = doc.page_count
+    first = args.first or 1
+    last = min(args.last or pageCount, pageCount)
+
+    shards = list()
+    start = first
+    while True:
+        end = min(start + args.shardSize - 1, last)
+        shards.append((start, end))
+        if end >= last:
+            return shards
+        start = end
+
+
+def mergeShards(shards):
+    # the last page of each shard is always selected by its shard, but whether it is needed
+    # is decided by the next shard, which compares it to the following page
+    relevantPages = set()
+    for i, pages in enumerate(shards):
+        relevantPages.update(pages if i == len(shards) - 1 else pages[:-1])
+    return sorted(relevantPages)
+
+
 def runJobs(jobDesc):
-    args, file = jobDesc
+    args, file, firstPage, lastPage = jobDesc
 
     argsImg = {'filename' : file,
               'resolution' : args.resolution,
-              'firstPage' : args.first,
-              'lastPage' : args.last,
+              'firstPage' : firstPage,
+              'lastPage' : lastPage,
               'maxColorDetection' : args.maxColors,
-              'overwriteBackgroundColor' : args.overwriteBackgroundColor,
-              'queue' : multiprocessing.Queue() if args.mode == 'BOTH' else None}
+              'overwriteBackgroundColor' : parseColor(args.overwriteBackgroundColor) if args.overwriteBackgroundColor else None,
+              'colorMethod' : args.colorMethod,
+              'thumbnailResolution' : args.thumbnailDpi,
+              'stats' : dict() if args.stats else None}
     argsHtml = {'filename' : file,
-                'firstPage' : args.first,
-                'lastPage' : args.last,
-                'queue' : multiprocessing.Queue() if args.mode == 'BOTH' else None}
+                'firstPage' : firstPage,
+                'lastPage' : lastPage}
+
+    readableSlideshowTextMode = readableSlideshowText
+    if args.textBackend == 'pdf2htmlEX' or pymupdf is None:
+        readableSlideshowTextMode = readableSlideshowHtml
+
     if args.mode == 'IMG':
-        relevantPages = readableSlideshowImg(**argsImg)
-    if args.mode == 'HTML':
-        relevantPages = readableSlideshowHtml(**argsHtml)
-    if args.mode == 'BOTH':
-        pImg = multiprocessing.Process(target=readableSlideshowImg, kwargs=argsImg)
-        pImg.start()
-        pHtml = multiprocessing.Process(target=readableSlideshowHtml, kwargs=argsHtml)
-        pHtml.start()
-
-        pImg.join()
-        pHtml.join()
-
-        img = argsImg['queue'].get()
-        html = argsHtml['queue'].get()
-        relevantPages = list(set(img).intersection(html))
-        relevantPages.sort()
+        relevantPages = readableSlideshowImg(**argsImg, renderer=args.renderer)
+    elif args.mode == 'HTML':
+        relevantPages = readableSlideshowTextMode(**argsHtml)
+    elif args.mode == 'BOTH':
+        if readableSlideshowTextMode is readableSlideshowText and args.renderer == 'pymupdf':
+            relevantPages = readableSlideshowBoth(**argsImg)
+        else:
+            # external tools can't be combined in a single pass, run both detections one after another
+            img = readableSlideshowImg(**argsImg, renderer=args.renderer)
+            html = readableSlideshowTextMode(**argsHtml)
+            relevantPages = list(set(img).intersection(html))
+            relevantPages.sort()
     else:
         raise Exception('Someone fucked up names of variables again')
-    saveRelevantPages(file, relevantPages, outputPrefix=args.output)
+    return relevantPages, argsImg['stats']
+
+
+def saveJob(jobDesc):
+    args, file, relevantPages = jobDesc
+    saveRelevantPages(file, relevantPages, outputPrefix=args.output, saveProfile=args.saveProfile)
 
 
 
 if __name__ == '__main__':
+    from tqdm.contrib.concurrent import process_map
+
     # parse commandline arguments
     args = parse()
     # argument checks
@@ -234,6 +557,20 @@ if __name__ == '__main__':
                 if child.is_file() and args.output not in child.name and child.suffix == '.pdf':
                     files.append(child)
     
+    # split long files into shards and process all shards of all files with the same workers
+    jobs = [(args, file, firstPage, lastPage) for file in files for firstPage, lastPage in shardPageRanges(file, args)]
+    results = process_map(runJobs, jobs, max_workers=args.jobs, chunksize=1)
+
+    shards = {file: list() for file in files}
+    stats = {file: collections.Counter() for file in files}
+    for (_, file, _, _), (relevantPages, shardStats) in zip(jobs, results):
+        shards[file].append(relevantPages)
+        stats[file].update(shardStats or dict())
+
+    if args.stats:
+        for file in files:
+            print(f'* STATS "{file.name}": ' + ', '.join(f'{tier}: {count}' for tier, count in stats[file].items()))
+
     # iterate over gathered files and make 'em readable
-    jobs = [(args, file) for file in files]
-    process_map(runJobs, jobs)
+    saveJobs = [(args, file, mergeShards(shards[file])) for file in files]
+    process_map(saveJob, saveJobs, max_workers=args.jobs, chunksize=1)
@@ -1,18 +1,29 @@
+import asyncio
 import datetime
+import functools
+import hashlib
 import io
 import os
 import pathlib
+import tempfile
 import uvicorn
 import zipfile
 import logging
 
 from fastapi import FastAPI, HTTPException, status, UploadFile
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from traceback import format_exc
 
 
-from src.pdf_tools_core import Document
+from src.admission import HTTP_413_CONTENT_TOO_LARGE, Admission, AdmissionMiddleware
+from src.jobs import PRIORITY_INTERACTIVE, Job, JobManager
+from src.pdf_tools_core import DEFAULT_SAVE_PROFILE, SAVE_PROFILES, ResultCache, init_worker, metrics, process_document, \
+    process_document_with_metrics, set_log_level, warm_up
+
+set_log_level(logging.WARNING)
 
 app = FastAPI(title='webpage-app', docs_url=None)
 api_app = FastAPI(title='api-app', docs_url=None)
@@ -20,6 +31,49 @@ api_app = FastAPI(title='api-app', docs_url=None)
 website_path = pathlib.Path('src/website.html')
 logs_path = pathlib.Path('logs/')
 
+# number of worker processes for the PDF processing and the maximum number of files that may wait for a worker
+max_workers = int(os.environ.get('PDF_TOOLS_WORKERS', os.cpu_count() or 1))
+max_queued_files = int(os.environ.get('PDF_TOOLS_MAX_QUEUE', 4 * max_workers))
+
+executor: ProcessPoolExecutor | None = None
+queued_files = 0
+
+# seconds a worker may spend on a single file before it is terminated, 0 disables the limit
+task_timeout = float(os.environ.get('PDF_TOOLS_TASK_TIMEOUT', 300))
+
+# cache for processed files, an in-memory tier and an optional on-disk tier
+cache_memory_bytes = int(os.environ.get('PDF_TOOLS_CACHE_MEMORY_MB', 256)) * 2**20
+cache_directory = os.environ.get('PDF_TOOLS_CACHE_DIR')
+cache_disk_bytes = int(os.environ.get('PDF_TOOLS_CACHE_DISK_MB', 2048)) * 2**20
+result_cache = None
+if cache_memory_bytes or cache_directory:
+    result_cache = ResultCache(cache_memory_bytes, cache_directory, cache_disk_bytes)
+
+# uploads are written to temporary files in this directory, the workers then open them by path
+spool_directory = os.environ.get('PDF_TOOLS_SPOOL_DIR') or None
+spool_chunk_size = 2**20
+
+# results of batch jobs are kept in this directory for the given number of seconds after the job finished
+jobs_path = pathlib.Path(os.environ.get('PDF_TOOLS_JOBS_DIR', 'jobs/'))
+job_ttl = float(os.environ.get('PDF_TOOLS_JOB_TTL', 3600))
+max_queued_job_files = int(os.environ.get('PDF_TOOLS_MAX_JOB_QUEUE', 1000))
+job_manager: JobManager | None = None
+
+# limits for uploads: size of a request and of each file, bytes of all uploads in flight and concurrent uploads per
+# client, uploads which exceed the in-flight budget wait up to the admission timeout
+max_request_bytes = int(os.environ.get('PDF_TOOLS_MAX_REQUEST_MB', 512)) * 2**20
+max_file_bytes = int(os.environ.get('PDF_TOOLS_MAX_FILE_MB', 256)) * 2**20
+max_in_flight_bytes = int(os.environ.get('PDF_TOOLS_MAX_IN_FLIGHT_MB', 1024)) * 2**20
+max_client_requests = int(os.environ.get('PDF_TOOLS_MAX_CLIENT_REQUESTS', 4))
+admission_timeout = float(os.environ.get('PDF_TOOLS_ADMISSION_TIMEOUT', 30))
+# addresses of reverse proxies, whose X-Forwarded-For header identifies the client for the per-client limit
+trusted_proxies = [address.strip() for address in os.environ.get('PDF_TOOLS_TRUSTED_PROXIES', '').split(',')
+                   if address.strip()]
+admission = Admission(max_request_bytes, max_in_flight_bytes, max_client_requests, admission_timeout)
+
+# per-stage timings and counters of the server and its workers, exposed at /api/metrics
+metrics.enabled = os.environ.get('PDF_TOOLS_METRICS', '1') not in ('', '0')
+
 
 def log_error(event, message):
     if not logs_path.is_dir():
@@ -37,6 +91,11 @@ available_actions = [
         'title': 'Remove Watermarks',
         'description': 'Remove watermarks by disabeling Optional Content Groups (OCG) within the PDF.'
     },
+    {
+        'id': 'strip_watermarks',
+        'title': 'Strip Watermarks',
+        'description': 'Remove watermarks and delete the content of their Optional Content Groups (OCG) from the pages, so they cannot be turned on again.'
+    },
     {
         'id': 'unlock_permissions',
         'title': 'Unlock Permissions',
@@ -44,55 +103,387 @@ available_actions = [
     }
 ]
 
+app.add_middleware(AdmissionMiddleware, admission=admission, paths=['/api/process-files', '/api/jobs'],
+                   trusted_proxies=trusted_proxies)
 app.mount('/api', api_app)
 app.mount('/', StaticFiles(directory='client', html=True), name='client')
 
 
-@api_app.post('/process-files')
-async def process_files(files: list[UploadFile], actions: list[str]):
+def get_executor() -> ProcessPoolExecutor:
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(metrics.enabled,))
+    return executor
+
+
+def terminate_executor(worker_executor: ProcessPoolExecutor):
+    # a stuck worker does not react to a shutdown, so the processes are terminated
+    for process in list((worker_executor._processes or {}).values()):
+        process.terminate()
+    worker_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def replace_executor(broken_executor: ProcessPoolExecutor):
+    """Shut down the executor whose worker crashed or got stuck, the next task starts a new one."""
+    global executor
+    if executor is not broken_executor:
+        # already replaced because of another task
+        return
+    executor = None
+    metrics.add('worker_restarts')
+    terminate_executor(broken_executor)
+
+
+@app.on_event('startup')
+async def start_workers():
+    global job_manager
+
+    # start and warm up all workers now instead of during the first requests
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*[loop.run_in_executor(get_executor(), warm_up) for _ in range(max_workers)])
+
+    job_manager = JobManager(jobs_path, run_pipeline, max_workers, job_ttl)
+    await job_manager.start()
+
+
+@app.on_event('shutdown')
+async def stop_workers():
+    if job_manager is not None:
+        await job_manager.stop()
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
+
+
+class ZipStreamBuffer:
+    """Write-only file object for `zipfile.ZipFile`, which collects the written data until it is sent as a chunk.
+
+    As the buffer is not seekable, `zipfile` writes data descriptors after each entry instead of seeking back.
+    """
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+async def stream_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """Asynchronously yield a zip archive, each entry is emitted as soon as it is available from `entries`."""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression) as zipf:
+        async for file_name, content in entries:
+            with metrics.stage('zip'):
+                await asyncio.to_thread(zipf.writestr, file_name, content)
+            del content
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def release_queue_slot(_):
+    global queued_files
+    queued_files -= 1
+
+
+async def spool_upload(file: UploadFile) -> tuple[pathlib.Path, str]:
+    """Copy an upload in chunks to a temporary file, which the workers open by path, and compute its digest along the
+    way. The upload itself has already been received by Starlette, which keeps it in memory or a temporary file."""
+    if file.size is not None and file.size > max_file_bytes:
+        raise HTTPException(HTTP_413_CONTENT_TOO_LARGE,
+                            detail=f'File "{file.filename}" exceeds the limit of {max_file_bytes} bytes.')
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix='.pdf', dir=spool_directory)
+    try:
+        with metrics.stage('spool'), os.fdopen(fd, 'wb') as fp:
+            while chunk := await file.read(spool_chunk_size):
+                size += len(chunk)
+                if size > max_file_bytes:
+                    raise HTTPException(HTTP_413_CONTENT_TOO_LARGE,
+                                        detail=f'File "{file.filename}" exceeds the limit of {max_file_bytes} bytes.')
+                digest.update(chunk)
+                fp.write(chunk)
+                metrics.add('spool_bytes', len(chunk))
+    except BaseException:
+        os.unlink(path)
+        raise
+    return pathlib.Path(path), digest.hexdigest()
+
+
+async def run_in_worker(function: functools.partial):
+    """Run a function in a worker process, which is terminated if the function exceeds the task timeout.
+
+    A crashed worker fails all tasks of the executor, which is therefore replaced. The failed tasks are retried in a
+    process of their own each, so that only the task which caused the crash fails.
+    """
+    loop = asyncio.get_running_loop()
+    worker_executor = get_executor()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(worker_executor, function), task_timeout or None)
+    except TimeoutError:
+        replace_executor(worker_executor)
+        raise TimeoutError(f'Processing took longer than {task_timeout:g} seconds.')
+    except BrokenProcessPool:
+        replace_executor(worker_executor)
+
+    isolated_executor = ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=(metrics.enabled,))
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(isolated_executor, function), task_timeout or None)
+    except TimeoutError:
+        raise TimeoutError(f'Processing took longer than {task_timeout:g} seconds.')
+    except BrokenProcessPool:
+        raise RuntimeError('The worker process crashed while processing the file.')
+    finally:
+        terminate_executor(isolated_executor)
+
+
+async def run_pipeline(file_name: str, path: pathlib.Path, digest: str, actions: list[str], save_profile: str) -> bytes:
+    """Process a single spooled file in a worker process, unless its result is already cached."""
     try:
-        processed_files: list[Document] = []
+        key = None
+        if result_cache:
+            key = ResultCache.key(digest, actions, {'save_profile': save_profile})
+            cached_content = await asyncio.to_thread(result_cache.get, key)
+            if cached_content is not None:
+                return cached_content
+
+        if metrics.enabled:
+            processed_content, worker_metrics = await run_in_worker(functools.partial(
+                process_document_with_metrics, file_name, actions=actions, path=path, save_profile=save_profile))
+            metrics.merge(worker_metrics)
+        else:
+            processed_content = await run_in_worker(functools.partial(
+                process_document, file_name, actions=actions, path=path, save_profile=save_profile))
+        if key:
+            await asyncio.to_thread(result_cache.put, key, processed_content)
+        return processed_content
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def parse_actions(actions: list[str]) -> list[str]:
+    if len(actions) == 1:
+        # actions were recognized as string and not comma separated list of strings
+        # still works if there is only one element in the string
+        actions = actions[0].split(',')
+    logging.debug(f'selected actions: "{actions}".')
+    return actions
+
+
+def check_save_profile(save_profile: str):
+    if save_profile not in SAVE_PROFILES:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f'Unknown save profile "{save_profile}".')
 
-        if len(actions) == 1:
-            # actions were recognized as string and not comma separated list of strings
-            # still works if there is only one element in the string
-            actions = actions[0].split(',')
-        logging.debug(f'selected actions: "{actions}".')
 
+async def spool_uploads(files: list[UploadFile]) -> list[tuple[str, pathlib.Path, str]]:
+    spooled_files = []
+    try:
         for file in files:
-            content = await file.read()
-            doc = Document(filename=file.filename, data=content)
-            for action in actions:
-                if action == 'remove_watermarks':
-                    doc.remove_watermarks()
-                elif action == 'unlock_permissions':
-                    doc.unlock_permissions()
-            processed_files.append(doc)
-
-        if len(processed_files) == 1:
-            doc = processed_files[0]
-            output_file_name = doc.file
-            output_file_content = doc.to_bytesIO()
+            spooled_files.append((file.filename, *await spool_upload(file)))
+    except BaseException:
+        for _, path, _ in spooled_files:
+            path.unlink(missing_ok=True)
+        raise
+    return spooled_files
+
+
+async def stream_job_results(job: Job, compression=zipfile.ZIP_DEFLATED, remove_job: bool = False):
+    """Yield the job's processed files as a zip archive, each one as soon as it is finished.
+
+    The response has already started when a file fails, so failed files are left out and their errors are listed in
+    an additional "errors.txt" entry, which keeps the archive valid.
+    """
+    async def finished_files():
+        async def wait(file):
+            await file.finished.wait()
+            return file
+
+        errors = []
+        for next_file in asyncio.as_completed([wait(file) for file in job.files]):
+            file = await next_file
+            try:
+                if file.status != 'done':
+                    raise RuntimeError(file.error or f'file was {file.status}')
+                content = await asyncio.to_thread(file.output_path.read_bytes)
+            except Exception as e:
+                errors.append(f'Failed to process "{file.name}": {e}\n')
+                continue
+            yield str(pathlib.Path(file.name)), content
+        if errors:
+            yield 'errors.txt', ''.join(errors).encode()
+
+    try:
+        async for chunk in stream_zip(finished_files(), compression):
+            yield chunk
+    finally:
+        if remove_job:
+            job_manager.cancel(job.id)
+
+
+@api_app.post('/process-files')
+async def process_files(files: list[UploadFile], actions: list[str], store_zip: bool = False,
+                        save_profile: str = DEFAULT_SAVE_PROFILE):
+    global queued_files
+
+    check_save_profile(save_profile)
+
+    if queued_files + len(files) > max_queued_files:
+        metrics.add('rejected_requests')
+        # fail fast instead of building up an unbounded backlog
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail='Server is busy, please try again later.',
+                            headers={'Retry-After': '5'})
+
+    # reserve the queue slots now, each one is released as soon as its file is processed
+    reserved_slots = len(files)
+    queued_files += reserved_slots
+    try:
+        actions = parse_actions(actions)
+
+        # a job which is processed before all batch jobs and removed as soon as its results are sent
+        job = job_manager.submit(await spool_uploads(files), actions, save_profile, PRIORITY_INTERACTIVE,
+                                 on_file_finished=release_queue_slot)
+        reserved_slots = 0
+
+        if len(job.files) == 1:
+            file = job.files[0]
+            await file.finished.wait()
+            try:
+                if file.status != 'done':
+                    raise RuntimeError(f'Failed to process "{file.name}": {file.error}')
+                output_file_content = io.BytesIO(await asyncio.to_thread(file.output_path.read_bytes))
+            finally:
+                job_manager.cancel(job.id)
+            output_file_name = pathlib.Path(file.name)
             content_type = 'application/pdf'
         else:
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for doc in processed_files:
-                    zipf.writestr(str(doc.file), doc.to_bytes())
-            zip_buffer.seek(0)
+            # processed PDFs are already deflated, so storing them skips a mostly pointless second compression
+            compression = zipfile.ZIP_STORED if store_zip else zipfile.ZIP_DEFLATED
 
             output_file_name = 'processed_files.zip'
-            output_file_content = zip_buffer
+            output_file_content = stream_job_results(job, compression, remove_job=True)
             content_type = 'application/zip'
 
         return StreamingResponse(output_file_content, headers={
             'Content-Disposition': f'attachment; filename={output_file_name}',
             'Content-Type': content_type
         })
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_error(e, 'Encountered an error during processing.')
+    finally:
+        queued_files -= reserved_slots
+
+
+def get_job(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Unknown job.')
+    return job
+
+
+@api_app.post('/jobs', status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(files: list[UploadFile], actions: list[str], save_profile: str = DEFAULT_SAVE_PROFILE):
+    check_save_profile(save_profile)
+
+    if job_manager.queued_files + len(files) > max_queued_job_files:
+        metrics.add('rejected_requests')
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail='Server is busy, please try again later.',
+                            headers={'Retry-After': '60'})
+
+    try:
+        job = job_manager.submit(await spool_uploads(files), parse_actions(actions), save_profile)
+        return job.to_dict()
+    except HTTPException:
+        raise
     except Exception as e:
         log_error(e, 'Encountered an error during processing.')
 
 
+@api_app.get('/jobs/{job_id}')
+async def get_job_status(job_id: str):
+    return get_job(job_id).to_dict()
+
+
+@api_app.get('/jobs/{job_id}/files/{index}')
+async def get_job_file(job_id: str, index: int):
+    job = get_job(job_id)
+    if not 0 <= index < len(job.files):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='Unknown file.')
+
+    file = job.files[index]
+    if file.status != 'done':
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=f'File is {file.status}.')
+    return FileResponse(file.output_path, media_type='application/pdf', filename=pathlib.Path(file.name).name)
+
+
+@api_app.get('/jobs/{job_id}/result')
+async def get_job_result(job_id: str, store_zip: bool = False):
+    job = get_job(job_id)
+    if job.status != 'finished':
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=f'Job is {job.status}.')
+    if any(file.status != 'done' for file in job.files):
+        raise HTTPException(status.HTTP_409_CONFLICT, detail='Not all files were processed successfully.')
+
+    compression = zipfile.ZIP_STORED if store_zip else zipfile.ZIP_DEFLATED
+    return StreamingResponse(stream_job_results(job, compression), headers={
+        'Content-Disposition': 'attachment; filename=processed_files.zip',
+        'Content-Type': 'application/zip'
+    })
+
+
+@api_app.delete('/jobs/{job_id}')
+async def cancel_job(job_id: str):
+    job = get_job(job_id)
+    job_manager.cancel(job.id)
+    return job.to_dict()
+
+
+@api_app.get('/cache-stats')
+async def get_cache_stats():
+    if not result_cache:
+        return {'enabled': False}
+    return {'enabled': True, 'memory_bytes': result_cache.memory_bytes, 'disk_bytes': result_cache.disk_bytes,
+            **result_cache.stats}
+
+
+@api_app.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics():
+    lines = [metrics.to_prometheus()]
+    gauges = {
+        'queued_files': queued_files,
+        'queued_job_files': job_manager.queued_files if job_manager else 0,
+        'jobs': len(job_manager.jobs) if job_manager else 0,
+        'admission_in_flight_bytes': admission.in_flight_bytes,
+        'admission_waiting_requests': admission.waiting_requests,
+    }
+    if result_cache:
+        gauges['cache_memory_bytes'] = result_cache.memory_bytes
+        gauges['cache_disk_bytes'] = result_cache.disk_bytes
+    for name, value in gauges.items():
+        lines.append(f'# TYPE pdf_tools_{name} gauge\npdf_tools_{name} {value}\n')
+    if result_cache:
+        for name, value in result_cache.stats.items():
+            lines.append(f'# TYPE pdf_tools_cache_{name}_total counter\npdf_tools_cache_{name}_total {value}\n')
+    for name, value in admission.stats.items():
+        lines.append(f'# TYPE pdf_tools_admission_{name}_total counter\npdf_tools_admission_{name}_total {value}\n')
+    return ''.join(lines)
+
+
 @api_app.get('/get-available-actions')
 async def get_available_actions():
     try: